@@ -3,26 +3,41 @@ from discord import app_commands, Color
 from discord.ext import commands
 import os
 import dice_roller
-from monster_manual import find_monster, display_monsters, mm_literals
+import rng_streams
+from monster_manual import MonsterCursor, ListCursor, display_monsters, mm_literals, suggest_monster_names, sample_monsters, search_monster_text
+from data.monsters import parse_cr
+from encounter import build_encounters, display_encounters
 from typing import Optional, Literal
 import dotenv
 from loot_generator import (
     parse_item_args, 
-    build_inventory_message, 
+    inventory_nav, 
     generate_item_for_user, 
     clear_inventory_for_user, 
-    generate_loot_for_user
+    generate_loot_for_user,
+    simulate_loot,
+    describe_simulation,
+    generate_party_hoard,
+    describe_party_hoard,
+    HOARD_TIERS,
+    hoard_tier,
 )
 import json
+import re
 from character_sheet import (
     init_db,
     get_character,
     insert_character,
     update_character,
     delete_character,
-    import_character_from_pdf,
+    import_character_from_bytes,
+    import_characters,
+    check_upload,
     set_character_owner,
-    get_character_by_discord
+    get_character_by_discord,
+    get_character_summary,
+    get_character_changes,
+    describe_changes,
 )
 from session_tracker import SessionTracker   
 
@@ -32,6 +47,9 @@ token = os.environ.get('discord_bot_token')
 ## Create tracker instance  
 tracker = SessionTracker()
 
+## Make sure the character tables exist
+init_db()
+
 ## Testing with simple commands
 intents = discord.Intents.default()
 intents.message_content = True
@@ -64,16 +82,28 @@ async def hello(ctx):
 ## Rolling the dice -KH 
 @bot.tree.command(name='roll')
 async def roll_die(interaction: discord.Interaction, dice: str):
-    character = get_character(interaction.user.id)
+    # owner lookup is cached in memory, so a roll doesn't touch the DB
+    character = get_character_summary(interaction.user.id)
 
     if character:
-        char_name = character["name"]
+        char_name = character.name
     else:
         char_name = interaction.user.display_name
 
-    result = dice_roller.roll(dice)
+    # each guild rolls from its own seeded stream; seed + position in the log lets a roll be replayed
+    rng = rng_streams.stream_for(interaction.guild_id)
+    position = rng.position
+    result = dice_roller.roll(dice, rng=rng)
+    tracker.record_roll(interaction.guild_id, char_name, dice, f"{result} (seed {rng.seed} @ {position})")
     await interaction.response.send_message(f"**{char_name}** {result}")
 
+## Exact odds for a roll, e.g. /rollstats 2d20kh1+5 dc:15
+@bot.tree.command(name='rollstats', description="Show the exact odds for a dice expression.")
+@app_commands.describe(dice="e.g. '20d12+3d8' or '2d20kh1+5'", dc="Optional DC to get the chance of meeting it.")
+async def roll_stats(interaction: discord.Interaction, dice: str, dc: Optional[int] = None):
+    result = dice_roller.stats(dice, dc)
+    await interaction.response.send_message(result, ephemeral=True)
+
 ## Search the monster manual -SM
 @bot.tree.command(name='monster')
 @app_commands.describe(
@@ -87,21 +117,75 @@ async def roll_die(interaction: discord.Interaction, dice: str):
     speed="Please select a speed type.",
     align="Please select an alignment.",
     legendary="Is the monster Legendary?",
+    mincr="Minimum challenge rating, e.g. 1/4 or 5.",
+    maxcr="Maximum challenge rating, e.g. 1/2 or 10.",
+    random="Pick this many random monsters from the matches.",
+    nearcr="With random, favor monsters close to this challenge rating.",
+    query="Free-text search, e.g. 'young red' or 'undead fiend'.",
     reveal="Let everyone see results?"
 )
 # All parameters are optional, so a user may use one, two, three, or all elements for their search if they'd like, allowing for more broad searches as well as more narrow searches. Also has amount variable to allow for getting a certain amount of monsters.--SM
-async def search_monster(ctx, name: Optional[str], category: Optional[str], size: Optional[mm_literals.sizes], minac: Optional[int], maxac: Optional[int], minhp: Optional[int], maxhp: Optional[int], speed: Optional[mm_literals.speeds], align: Optional[mm_literals.alignments], legendary: Optional[Literal["Yes", "No"]], reveal: Optional[Literal["Yes","No"]]):
-    # Creates a list from the find monsters method with the search terms used, if any were input.--SM
+async def search_monster(ctx, name: Optional[str], category: Optional[str], size: Optional[mm_literals.sizes], minac: Optional[int], maxac: Optional[int], minhp: Optional[int], maxhp: Optional[int], speed: Optional[mm_literals.speeds], align: Optional[mm_literals.alignments], legendary: Optional[Literal["Yes", "No"]], reveal: Optional[Literal["Yes","No"]], mincr: Optional[str] = None, maxcr: Optional[str] = None, random: Optional[app_commands.Range[int, 1, 25]] = None, nearcr: Optional[str] = None, query: Optional[str] = None):
+    # Creates a cursor over the search terms used, if any were input. Pages are looked up as the user moves through the menu.--SM
     
-    results = await find_monster(name, category, size, minac, maxac, minhp, maxhp, speed, align, legendary)
+    try:
+        cursor = MonsterCursor.from_search(
+            name=name, category=category, size=size, minac=minac, maxac=maxac, minhp=minhp, maxhp=maxhp,
+            speed=speed, align=align, legendary=legendary, mincr=mincr, maxcr=maxcr
+        )
+        # ranked full-text hits, narrowed by any other search terms
+        if query:
+            cursor = ListCursor(search_monster_text(query, cursor.filters))
+        # random encounter rolls: sample from the matches instead of paging through all of them
+        elif random:
+            rng = rng_streams.stream_for(ctx.guild_id)
+            cursor = ListCursor(sample_monsters(cursor.filters, random, rng=rng, target_cr=parse_cr(nearcr)))
+    except ValueError as e:
+        await ctx.response.send_message(f"Error: {e}", ephemeral=True)
+        return
    
-    if not results:
+    if cursor.first() is None:
         embed = discord.Embed(
             title="Could not find monsters meeting your search.", description="Please check to ensure your search values are valid, or try a different search."
         )
         await ctx.response.send_message(embed=embed, ephemeral=True)
     else:
-        await display_monsters(ctx, results, tracker, reveal)     
+        await display_monsters(ctx, cursor, tracker, reveal)     
+
+# Suggests monster names as the user types, typos included.
+@search_monster.autocomplete('name')
+async def monster_name_autocomplete(interaction: discord.Interaction, current: str):
+    return [app_commands.Choice(name=name, value=name) for name in suggest_monster_names(current)]
+
+## Build encounters sized for the party, using the active session's level and players unless given
+@bot.tree.command(name="encounter", description="Build random encounters that fit the party's XP budget.")
+@app_commands.describe(
+    difficulty="How hard the encounter should be.",
+    players="Party size (defaults to the players in the active session).",
+    level="Party level (defaults to the active session's level).",
+    category="Only use monsters of this type.",
+    reveal="Let everyone see results?"
+)
+async def encounter(interaction: discord.Interaction, difficulty: Literal["easy", "medium", "hard", "deadly"] = "medium", players: Optional[app_commands.Range[int, 1, 20]] = None, level: Optional[app_commands.Range[int, 1, 20]] = None, category: Optional[str] = None, reveal: Optional[Literal["Yes","No"]] = None):
+    session = tracker.get_active_session(interaction.guild_id)
+    if session:
+        players = players or len(session["players"])
+        level = level or session["level"]
+
+    if not players or not level:
+        await interaction.response.send_message("No active session. Start one with `/session_start` or give players and level.", ephemeral=True)
+        return
+
+    filters = MonsterCursor.from_search(category=category).filters
+    encounters = build_encounters(players, level, difficulty, filters, rng=rng_streams.stream_for(interaction.guild_id))
+
+    if not encounters:
+        embed = discord.Embed(
+            title="Could not build an encounter.", description="No monsters fit that budget. Try a different difficulty or category."
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    else:
+        await display_encounters(interaction, encounters, tracker, reveal)
 
 @bot.tree.command(name="item", description="Get a random item and add it to your inventory.")
 @app_commands.describe(fields="e.g. 'common weapon', 'common light armor', 'rare ring magic'")
@@ -114,6 +198,7 @@ async def item(interaction: discord.Interaction, fields: str = ""):
         rarity=rarity,
         item_type=item_type,
         magic_only=magic_only,
+        rng=rng_streams.stream_for(interaction.guild_id),
     )
 
     embed = discord.Embed(
@@ -126,15 +211,10 @@ async def item(interaction: discord.Interaction, fields: str = ""):
 # inventory – shows the user's items - AM
 @bot.tree.command(name="inventory", description="Show your item inventory.")
 async def inventory(interaction: discord.Interaction):
-    msg = build_inventory_message(str(interaction.user.id))
+    # one page at a time; the buttons fetch the next page on demand
+    view = inventory_nav(str(interaction.user.id), f"{interaction.user.display_name}'s Inventory")
 
-    embed = discord.Embed(
-        title=f"{interaction.user.display_name}'s Inventory",
-        description=msg,
-        color=0x3498db,
-    )
-
-    await interaction.response.send_message(embed=embed)
+    await interaction.response.send_message(embed=view.embed(), view=view)
 
 @bot.tree.command(name="loot", description="Generate a pile of random loot and add it to your inventory.")
 @app_commands.describe(chest_type="pouch (small), chest (medium), or hoard (big)")
@@ -144,6 +224,7 @@ async def loot(interaction: discord.Interaction, chest_type: str = "chest"):
         discord_id=str(interaction.user.id),
         chest_type=chest_type,
         magic_only=False,  # set True for magic-only chests
+        rng=rng_streams.stream_for(interaction.guild_id),
     )
 
     # log to session tracker - NM
@@ -157,6 +238,70 @@ async def loot(interaction: discord.Interaction, chest_type: str = "chest"):
 
     await interaction.response.send_message(embed=embed)
 
+# Treasure hoard for the whole party after a fight, sized by the monster's CR (or the party level)
+@bot.tree.command(name="hoard", description="Roll a treasure hoard for the party based on what they defeated.")
+@app_commands.describe(
+    monster="The monster that was defeated (its CR sets the loot tier).",
+    cr="Challenge rating to use instead of a monster.",
+    level="Party level to use if there's no monster or CR (defaults to the active session's level).",
+    players="Mention everyone who gets loot (defaults to you).",
+)
+async def hoard(interaction: discord.Interaction, monster: Optional[str] = None, cr: Optional[str] = None, level: Optional[int] = None, players: Optional[str] = None):
+    try:
+        cr_value = parse_cr(cr)
+        if monster:
+            found = MonsterCursor.from_search(name=monster.strip().lower()).first()
+            if found is None:
+                await interaction.response.send_message(f"I couldn't find a monster called {monster}.", ephemeral=True)
+                return
+            cr_value = found.cr_value
+    except ValueError as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
+        return
+
+    session = tracker.get_active_session(interaction.guild_id)
+    if level is None and session:
+        level = session["level"]
+    if cr_value is None and level is None:
+        await interaction.response.send_message("Give a monster, a CR or a party level (or start a session).", ephemeral=True)
+        return
+
+    member_ids = re.findall(r"<@!?(\d+)>", players or "") or [str(interaction.user.id)]
+    names = {}
+    for member_id in member_ids:
+        member = interaction.guild.get_member(int(member_id)) if interaction.guild else None
+        names[member_id] = member.display_name if member else f"<@{member_id}>"
+
+    drops = generate_party_hoard(member_ids, cr=cr_value, level=level, rng=rng_streams.stream_for(interaction.guild_id))
+    result = describe_party_hoard(drops, names)
+    tracker.log_action(interaction.guild_id, f"{interaction.user.name} rolled a hoard: {result}")
+
+    embed = discord.Embed(
+        title=f"Treasure hoard ({HOARD_TIERS[hoard_tier(cr_value, level)].name})",
+        description=result,
+        color=0x3498db,
+    )
+
+    await interaction.response.send_message(embed=embed)
+
+@hoard.autocomplete('monster')
+async def hoard_monster_autocomplete(interaction: discord.Interaction, current: str):
+    return await monster_name_autocomplete(interaction, current)
+
+@bot.tree.command(name="lootsim", description="Simulate many loot drops and see what they would give. Nothing is saved.")
+@app_commands.describe(drops="How many drops to simulate", chest_type="pouch (small), chest (medium), or hoard (big)", magic_only="Only magic items")
+async def lootsim(interaction: discord.Interaction, drops: app_commands.Range[int, 1, 100000] = 500, chest_type: str = "hoard", magic_only: bool = False):
+    # for tuning RARITY_WEIGHTS and chest sizes
+    sim = simulate_loot(drops, chest_type=chest_type, magic_only=magic_only)
+
+    embed = discord.Embed(
+        title=f"Loot simulation: {drops} x {chest_type}",
+        description=describe_simulation(sim, chest_type),
+        color=0x3498db,
+    )
+
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 @bot.tree.command(name="clear_inventory", description="Delete all items from your inventory.")
 async def clear_inventory(interaction: discord.Interaction):
     deleted = clear_inventory_for_user(str(interaction.user.id))
@@ -215,17 +360,39 @@ def format_character(row):
 async def importsheet(interaction: discord.Interaction, pdf: discord.Attachment):
     await interaction.response.defer()
 
-    file_path = f"./temp_{pdf.filename}"
-    await pdf.save(file_path)
-
+    # parsed from memory in the PDF worker pool, so the bot keeps answering while it runs
     try:
-        char_name = import_character_from_pdf(file_path)
+        check_upload(pdf.filename, pdf.size)
+        char_name = await import_character_from_bytes(await pdf.read())
         set_character_owner(char_name, str(interaction.user.id))
         msg = f"Character **{char_name}** imported and assigned to you!"
     except Exception as e:
         msg = f"Error importing sheet: {e}"
 
-    os.remove(file_path)
+    await interaction.followup.send(msg)
+
+## Bulk import for a new campaign: several sheets and/or zips of sheets at once. Nobody is assigned as owner;
+## players claim theirs with /importsheet.
+@bot.tree.command(name="importsheets", description="Import several PDF character sheets (or zips of them) at once")
+@app_commands.describe(file1="A character sheet PDF or a zip of them", file2="Another PDF or zip", file3="Another PDF or zip",
+                       file4="Another PDF or zip", file5="Another PDF or zip")
+async def importsheets(interaction: discord.Interaction, file1: discord.Attachment, file2: Optional[discord.Attachment] = None,
+                       file3: Optional[discord.Attachment] = None, file4: Optional[discord.Attachment] = None,
+                       file5: Optional[discord.Attachment] = None):
+    await interaction.response.defer()
+
+    attachments = [a for a in (file1, file2, file3, file4, file5) if a is not None]
+    try:
+        for a in attachments:
+            check_upload(a.filename, a.size)
+        files = [(a.filename, await a.read()) for a in attachments]
+        results = await import_characters(files)
+        msg = "\n".join(f"**{filename}:** {result}" for filename, result in results) or "No PDFs found."
+    except Exception as e:
+        msg = f"Error importing sheets: {e}"
+
+    if len(msg) > 1990:
+        msg = msg[:1986] + "..."
     await interaction.followup.send(msg)
 
 ## Print character command based on the discord user ID - KH
@@ -268,6 +435,23 @@ async def character(interaction: discord.Interaction):
 
     await interaction.followup.send(embed=embed)
 
+## What changed on your sheet in the last imports
+@bot.tree.command(name="sheetchanges", description="Show what changed on your character sheet in recent imports.")
+@app_commands.describe(imports="How many imports back to look (default: the last one)")
+async def sheetchanges(interaction: discord.Interaction, imports: app_commands.Range[int, 1, 10] = 1):
+    row = get_character_by_discord(str(interaction.user.id))
+    if not row:
+        await interaction.response.send_message("You haven't been assigned a character yet! Use /importsheet first!", ephemeral=True)
+        return
+
+    changes = get_character_changes(row["name"], imports)
+    text = describe_changes(changes) if changes else "No changes since the first import."
+    if len(text) > 4000:
+        text = text[:3996] + "..."
+
+    embed = discord.Embed(title=f"{row['name']}: sheet changes", description=text, color=0x3498db)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 # session commands -NM
 
 @bot.command(name='session_start')
@@ -279,6 +463,9 @@ async def session_start(ctx, session_number: int, location: str, level: int):
         return
     
     tracker.add_player(ctx.guild.id, ctx.author.name)
+    # fresh dice/loot seed per session, logged so disputed rolls can be replayed from the recap
+    rng = rng_streams.service.reseed(ctx.guild.id)
+    tracker.log_action(ctx.guild.id, f"RNG seed for this session: {rng.seed}")
     await ctx.send(embed=embed)
 
 @bot.command(name='session_end')
@@ -1,6 +1,16 @@
 import sqlite3
 import json
+import asyncio
+import hashlib
+import io
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
+from typing import Dict, List, Tuple, Union
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import NamedTuple, Optional
 from PyPDF2 import PdfReader
 
 ##Chatacter sheet pdf handling and CRUD functions. -KH
@@ -14,6 +24,59 @@ def get_connection():
     return conn
 
 
+## Who plays what, kept in memory: /roll looks up the roller's character on every roll, so owner -> character
+## summary is cached here (including "no character", which is most rollers). Anything that changes a character
+## or its owner drops the affected entries.
+
+class CharacterSummary(NamedTuple):
+    id: int
+    name: str
+    class_level: str
+    race: str
+    background: str
+
+
+OWNER_CACHE_SIZE = 4096
+_owner_cache: "OrderedDict[str, Optional[CharacterSummary]]" = OrderedDict()
+_owner_lock = threading.Lock()
+
+
+def _forget_owner(discord_id):
+    with _owner_lock:
+        _owner_cache.pop(str(discord_id), None)
+
+
+def _forget_characters(names):
+    names = set(names)
+    with _owner_lock:
+        for discord_id in [d for d, summary in _owner_cache.items() if summary is not None and summary.name in names]:
+            del _owner_cache[discord_id]
+
+
+def get_character_summary(discord_id) -> Optional[CharacterSummary]:
+    # The character a Discord user owns (the first one, if they have several), or None.
+    discord_id = str(discord_id)
+    with _owner_lock:
+        if discord_id in _owner_cache:
+            _owner_cache.move_to_end(discord_id)
+            return _owner_cache[discord_id]
+    conn = get_connection()
+    try:
+        row = conn.execute("""
+            SELECT id, name, class_level, race, background FROM characters
+            WHERE discord_id = ? ORDER BY id LIMIT 1
+        """, (discord_id,)).fetchone()
+    finally:
+        conn.close()
+    summary = None if row is None else CharacterSummary(row["id"], row["name"], row["class_level"] or "", row["race"] or "", row["background"] or "")
+    with _owner_lock:
+        _owner_cache[discord_id] = summary
+        _owner_cache.move_to_end(discord_id)
+        while len(_owner_cache) > OWNER_CACHE_SIZE:
+            _owner_cache.popitem(last=False)
+    return summary
+
+
 ##Crud stuff
 def init_db():
     conn = get_connection()
@@ -31,6 +94,35 @@ def init_db():
     )
     """)
 
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_characters_discord_id ON characters(discord_id)")
+
+    # older DBs were created without UNIQUE on name; keep the newest row per name and add the index the upserts need
+    cur.execute("DELETE FROM characters WHERE id NOT IN (SELECT max(id) FROM characters GROUP BY name)")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_characters_name ON characters(name)")
+
+    # parsed sheets by the sha256 of the PDF, so re-uploading the same file skips PyPDF2
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sheet_cache (
+        hash TEXT PRIMARY KEY,
+        fields JSON NOT NULL,
+        created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    # one row per import: only the fields that changed since the previous version ({"set": {...}, "del": [...]}).
+    # Version 1 is the whole first sheet, so any version can be rebuilt by replaying deltas from there.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS character_versions (
+        character_id INTEGER NOT NULL,
+        version INTEGER NOT NULL,
+        created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        delta JSON NOT NULL,
+        PRIMARY KEY (character_id, version)
+    )
+    """)
+
+    cur.execute("DELETE FROM character_versions WHERE character_id NOT IN (SELECT id FROM characters)")
+
     conn.commit()
     conn.close()
 
@@ -44,6 +136,8 @@ def set_character_owner(name: str, discord_id: str):
                 """, (discord_id, name))
     conn.commit()
     conn.close()
+    _forget_characters([name])
+    _forget_owner(discord_id)
 
 
 def insert_character(name, data):
@@ -83,14 +177,17 @@ def update_character(name, data):
 
     conn.commit()
     conn.close()
+    _forget_characters([name])
 
 
 def delete_character(name):
     conn = get_connection()
     cur = conn.cursor()
+    cur.execute("DELETE FROM character_versions WHERE character_id IN (SELECT id FROM characters WHERE name = ?)", (name,))
     cur.execute("DELETE FROM characters WHERE name = ?", (name,))
     conn.commit()
     conn.close()
+    _forget_characters([name])
 
 
 def get_character(name):
@@ -102,9 +199,10 @@ def get_character(name):
     return row
 
 
-def parse_pdf(path: str) -> dict:
-    reader = PdfReader(path)
-    raw_fields = reader.get_fields()
+def parse_pdf(source: Union[str, bytes]) -> dict:
+    # source is a file path or the PDF's bytes straight from the attachment
+    reader = PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source)
+    raw_fields = reader.get_fields() or {}
 
     parsed = {}
 
@@ -122,30 +220,408 @@ def parse_pdf(path: str) -> dict:
             except:
                 val = val.decode("latin-1")
 
-        parsed[key] = val
+        # PyPDF2 hands back its own str/name subclasses; plain str keeps the dict picklable and JSON-friendly
+        parsed[str(key)] = val if isinstance(val, (int, float)) else str(val)
 
     return parsed
 
 
-def import_character_from_pdf(pdf_path: str):
-    data = parse_pdf(pdf_path)
+## PDF parsing runs in a small process pool so a big or broken sheet can't freeze the bot. Jobs get the attachment
+## bytes directly (no temp files), each one has a timeout, and only so many can be waiting at once.
+
+PDF_WORKERS = 2
+PDF_MAX_PENDING = 8             # imports parsing or queued; more than that gets told to try again
+PDF_TIMEOUT = 20.0              # seconds per sheet
+PDF_MAX_BYTES = 10 * 1024 * 1024
+
+
+class SheetImportError(Exception):
+    pass
+
+
+class PdfParsePool:
+    # At most `workers` sheets are in the executor at once, so a job's timeout only starts once a worker is free
+    # for it. Waiting for a slot doesn't count against the sheet.
+
+    def __init__(self, workers: int = PDF_WORKERS, max_pending: int = PDF_MAX_PENDING, timeout: float = PDF_TIMEOUT):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = 0
+        self._executor = None
+        self._slots = asyncio.Semaphore(workers)
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _kill(self, executor: ProcessPoolExecutor):
+        # A worker stuck on a bad sheet can't be cancelled, so drop that pool and start fresh on the next job.
+        # Other sheets running in it at the time see BrokenProcessPool and are retried in the new pool.
+        if self._executor is executor:
+            self._executor = None
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _reserve(self):
+        if self.pending >= self.max_pending:
+            raise SheetImportError("Too many sheets are being imported right now, try again in a minute.")
+        self.pending += 1
+
+    async def _run(self, data: bytes) -> dict:
+        if len(data) > PDF_MAX_BYTES:
+            raise SheetImportError(f"That PDF is too big (max {PDF_MAX_BYTES // (1024 * 1024)} MB).")
+        loop = asyncio.get_running_loop()
+        async with self._slots:
+            for attempt in range(2):
+                executor = self._pool()
+                try:
+                    return await asyncio.wait_for(loop.run_in_executor(executor, parse_pdf, data), self.timeout)
+                except asyncio.TimeoutError:
+                    self._kill(executor)
+                    raise SheetImportError(f"Reading that sheet took longer than {self.timeout:g}s, is it a fillable character sheet?") from None
+                except BrokenProcessPool:
+                    # another sheet's timeout took the pool down (or this one crashed a worker); one more try
+                    self._kill(executor)
+        raise SheetImportError("The sheet reader crashed on that file, is it a fillable character sheet?")
+
+    async def parse(self, data: bytes) -> dict:
+        self._reserve()
+        try:
+            return await self._run(data)
+        finally:
+            self.pending -= 1
+
+    async def parse_many(self, blobs: List[bytes]) -> list:
+        # A bulk import takes one pending slot; its sheets share the worker slots with everyone else's.
+        # Each result is the field dict or the exception that sheet raised.
+        self._reserve()
+        try:
+            return await asyncio.gather(*(self._run(data) for data in blobs), return_exceptions=True)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+pdf_pool = PdfParsePool()
+
+
+SHEET_CACHE_SIZE = 500          # parsed sheets kept; the oldest go first
+
+
+def sheet_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_cached_sheet(digest: str):
+    conn = get_connection()
+    try:
+        row = conn.execute("SELECT fields FROM sheet_cache WHERE hash = ?", (digest,)).fetchone()
+    finally:
+        conn.close()
+    return None if row is None else json.loads(row["fields"])
 
-    # name field in your PDF
-    name = data.get("CharacterName", "").strip()
 
+def cache_sheet(digest: str, fields: dict):
+    conn = get_connection()
+    try:
+        conn.execute("INSERT OR REPLACE INTO sheet_cache (hash, fields) VALUES (?, ?)", (digest, json.dumps(fields)))
+        conn.execute("""
+            DELETE FROM sheet_cache WHERE hash NOT IN
+            (SELECT hash FROM sheet_cache ORDER BY created_at DESC, rowid DESC LIMIT ?)
+        """, (SHEET_CACHE_SIZE,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _cached_sheets(blobs: List[bytes]) -> Tuple[List[str], list]:
+    # Hashes and cache lookups for a batch of sheets. Blocking (sha256 of every file, sqlite), so callers run it in a thread.
+    digests = [sheet_hash(data) for data in blobs]
+    return digests, [get_cached_sheet(digest) for digest in digests]
+
+
+def _cache_sheets(parsed: List[Tuple[str, dict]]):
+    for digest, fields in parsed:
+        cache_sheet(digest, fields)
+
+
+async def parse_sheet(data: bytes) -> dict:
+    # Fields of an uploaded sheet: from the cache if this exact file was seen before, otherwise parsed in the pool.
+    (digest,), (fields,) = await asyncio.to_thread(_cached_sheets, [data])
+    if fields is None:
+        fields = await pdf_pool.parse(data)
+        await asyncio.to_thread(cache_sheet, digest, fields)
+    return fields
+
+
+async def parse_sheets(blobs: List[bytes]) -> list:
+    # parse_sheet for a whole batch: cached sheets come straight back, the rest are parsed in parallel in the pool.
+    digests, results = await asyncio.to_thread(_cached_sheets, blobs)
+    todo = [i for i, fields in enumerate(results) if fields is None]
+    for i, fields in zip(todo, await pdf_pool.parse_many([blobs[i] for i in todo])):
+        results[i] = fields
+    await asyncio.to_thread(_cache_sheets, [(digests[i], results[i]) for i in todo if isinstance(results[i], dict)])
+    return results
+
+
+## Re-imports only write what changed. The new sheet is diffed against the stored one, only the changed fields are
+## merged into the stored JSON (json_patch), and the delta is kept in character_versions. Any number of sheets go in
+## with one INSERT ... ON CONFLICT(name) DO UPDATE batch in a single transaction.
+
+UPSERT_CHARACTER = """
+    INSERT INTO characters (name, class_level, race, background, data)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(name) DO UPDATE SET
+        class_level = excluded.class_level,
+        race = excluded.race,
+        background = excluded.background,
+        data = json_patch(characters.data, ?)
+"""
+NAME_BATCH = 500                # names per IN (...) lookup
+
+
+def diff_fields(old: dict, new: dict) -> dict:
+    delta = {}
+    changed = {k: v for k, v in new.items() if k not in old or old[k] != v}
+    removed = [k for k in old if k not in new]
+    if changed:
+        delta["set"] = changed
+    if removed:
+        delta["del"] = removed
+    return delta
+
+
+def apply_delta(fields: dict, delta: dict) -> dict:
+    fields = dict(fields)
+    fields.update(delta.get("set", {}))
+    for key in delta.get("del", []):
+        fields.pop(key, None)
+    return fields
+
+
+def _merge_patch(delta: dict) -> dict:
+    # the delta as a JSON merge patch: changed values as-is, removed fields as null
+    patch = dict(delta.get("set", {}))
+    patch.update({key: None for key in delta.get("del", [])})
+    return patch
+
+
+def _select_by_name(cur, sql: str, names: List[str]) -> list:
+    rows = []
+    for start in range(0, len(names), NAME_BATCH):
+        chunk = names[start:start + NAME_BATCH]
+        rows += cur.execute(sql.format(", ".join("?" for _ in chunk)), chunk).fetchall()
+    return rows
+
+
+def sheet_name(data: dict) -> str:
+    name = data.get("CharacterName", "").strip()
     if not name:
         raise ValueError("Character sheet has no CharacterName field set!")
+    return name
 
-    existing = get_character(name)
 
-    if existing:
-        print(f"Updating existing character: {name}")
-        update_character(name, data)
-    else:
-        print(f"Inserting new character: {name}")
-        insert_character(name, data)
+def save_characters(sheets: List[dict]) -> List[Tuple[str, str]]:
+    # Insert or update every sheet in one transaction. Returns (name, "added" / "updated" / "unchanged") per sheet.
+    # If the same character comes up twice, the later sheet wins.
+    by_name: Dict[str, dict] = {}
+    for data in sheets:
+        by_name[sheet_name(data)] = data
+    names = list(by_name)
 
-    return name
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        existing = {row["name"]: row for row in _select_by_name(cur, "SELECT id, name, data FROM characters WHERE name IN ({})", names)}
+        versioned = {row["character_id"] for row in _select_by_name(
+            cur, "SELECT DISTINCT v.character_id FROM character_versions v JOIN characters c ON c.id = v.character_id WHERE c.name IN ({})", names)}
+
+        status: Dict[str, str] = {}
+        rows = []
+        deltas: Dict[str, List[dict]] = {}
+        for name, data in by_name.items():
+            row = existing.get(name)
+            if row is None:
+                status[name] = "added"
+                deltas[name] = [{"set": data}]
+                patch = data
+            else:
+                old = json.loads(row["data"])
+                delta = diff_fields(old, data)
+                if not delta:
+                    status[name] = "unchanged"
+                    continue
+                status[name] = "updated"
+                # characters from before versioning get their current sheet as version 1
+                deltas[name] = ([] if row["id"] in versioned else [{"set": old}]) + [delta]
+                patch = _merge_patch(delta)
+            rows.append((
+                name,
+                data.get("ClassLevel", ""),
+                data.get("Race ", ""),
+                data.get("Background", ""),
+                json.dumps(data),
+                json.dumps(patch),
+            ))
+
+        if rows:
+            cur.executemany(UPSERT_CHARACTER, rows)
+            ids = {row["name"]: row["id"] for row in _select_by_name(cur, "SELECT id, name FROM characters WHERE name IN ({})", list(deltas))}
+            for name, character_deltas in deltas.items():
+                for delta in character_deltas:
+                    _add_version(cur, ids[name], delta)
+        conn.commit()
+    finally:
+        conn.close()
+    _forget_characters([name for name, state in status.items() if state == "updated"])
+
+    for name, state in status.items():
+        print(f"{state.title()} character: {name}")
+    return [(name, status[name]) for name in names]
+
+
+def _add_version(cur, character_id: int, delta: dict):
+    cur.execute("""
+        INSERT INTO character_versions (character_id, version, delta)
+        VALUES (?, (SELECT coalesce(max(version), 0) + 1 FROM character_versions WHERE character_id = ?), ?)
+    """, (character_id, character_id, json.dumps(delta)))
+
+
+def save_character(data: dict) -> str:
+    # Insert or update the character a parsed sheet describes. Returns its name.
+    return save_characters([data])[0][0]
+
+
+def get_character_changes(name: str, versions: int = 1) -> list:
+    # (version, created_at, delta) for the last `versions` imports of a character, newest first.
+    conn = get_connection()
+    try:
+        rows = conn.execute("""
+            SELECT v.version, v.created_at, v.delta FROM character_versions v
+            JOIN characters c ON c.id = v.character_id
+            WHERE c.name = ? AND v.version > 1
+            ORDER BY v.version DESC LIMIT ?
+        """, (name, versions)).fetchall()
+    finally:
+        conn.close()
+    return [(row["version"], row["created_at"], json.loads(row["delta"])) for row in rows]
+
+
+def get_character_version(name: str, version: int):
+    # The sheet as it was at `version`, rebuilt from the deltas.
+    conn = get_connection()
+    try:
+        rows = conn.execute("""
+            SELECT v.delta FROM character_versions v
+            JOIN characters c ON c.id = v.character_id
+            WHERE c.name = ? AND v.version <= ?
+            ORDER BY v.version
+        """, (name, version)).fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        return None
+    fields = {}
+    for row in rows:
+        fields = apply_delta(fields, json.loads(row["delta"]))
+    return fields
+
+
+def describe_changes(changes: list) -> str:
+    # Oldest first, so later changes to a field read as overriding earlier ones.
+    lines = []
+    for version, created_at, delta in reversed(changes):
+        lines.append(f"**Version {version}** ({created_at})")
+        lines += [f"{key.strip()}: {value}" for key, value in delta.get("set", {}).items()]
+        lines += [f"{key.strip()}: removed" for key in delta.get("del", [])]
+    return "\n".join(lines)
+
+
+def import_character_from_pdf(pdf_path: str):
+    data = Path(pdf_path).read_bytes()
+    digest = sheet_hash(data)
+    fields = get_cached_sheet(digest)
+    if fields is None:
+        fields = parse_pdf(data)
+        cache_sheet(digest, fields)
+    return save_character(fields)
+
+
+MAX_BULK_SHEETS = 50
+ZIP_MAX_BYTES = 50 * 1024 * 1024        # one uploaded zip, before it's opened
+
+
+def check_upload(filename: str, size: int):
+    # Called with Attachment.size before the attachment is downloaded.
+    limit = ZIP_MAX_BYTES if filename.lower().endswith(".zip") else PDF_MAX_BYTES
+    if size > limit:
+        raise SheetImportError(f"{filename} is too big (max {limit // (1024 * 1024)} MB).")
+
+
+def _sheet_files(files: List[Tuple[str, bytes]]) -> List[Tuple[str, bytes]]:
+    # Uploaded files -> (filename, pdf bytes); zips are opened in memory and their PDFs taken out.
+    # The sheet count is checked from the zip's directory before anything is decompressed. Blocking: decompressing
+    # a full zip takes a while, so import_characters runs this in a thread.
+    sheets = []
+    for filename, data in files:
+        if filename.lower().endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                members = [info for info in archive.infolist()
+                           if not info.is_dir() and info.filename.lower().endswith(".pdf")]
+                if len(sheets) + len(members) > MAX_BULK_SHEETS:
+                    raise SheetImportError(f"That's more than {MAX_BULK_SHEETS} sheets, split them into smaller imports.")
+                for info in members:
+                    if info.file_size > PDF_MAX_BYTES:
+                        raise SheetImportError(f"{info.filename} is too big (max {PDF_MAX_BYTES // (1024 * 1024)} MB).")
+                for info in members:
+                    sheets.append((f"{filename}/{info.filename}", archive.read(info)))
+        else:
+            if len(sheets) + 1 > MAX_BULK_SHEETS:
+                raise SheetImportError(f"That's more than {MAX_BULK_SHEETS} sheets, split them into smaller imports.")
+            sheets.append((filename, data))
+    return sheets
+
+
+async def import_characters(files: List[Tuple[str, bytes]]) -> List[Tuple[str, str]]:
+    # Bulk import for a whole campaign: PDFs and zips of PDFs, parsed in parallel and saved in one transaction.
+    # Returns (filename, what happened) per sheet, in upload order; one bad sheet doesn't stop the others.
+    # Everything is keyed by position, two uploads can both be called character.pdf.
+    sheets = await asyncio.to_thread(_sheet_files, files)
+    parsed = await parse_sheets([data for _, data in sheets])
+    report: Dict[int, str] = {}
+    good = []
+    for position, fields in enumerate(parsed):
+        if isinstance(fields, Exception):
+            report[position] = f"error: {fields}"
+            continue
+        try:
+            name = sheet_name(fields)
+        except ValueError as e:
+            report[position] = f"error: {e}"
+            continue
+        good.append((position, name, fields))
+
+    status = dict(await asyncio.to_thread(save_characters, [fields for _, _, fields in good])) if good else {}
+    last_sheet = {name: position for position, name, _ in good}
+    for position, name, _ in good:
+        if last_sheet[name] == position:
+            report[position] = f"{name} ({status[name]})"
+        else:
+            kept = last_sheet[name]
+            report[position] = f"{name} (skipped, sheet {kept + 1} ({sheets[kept][0]}) is the same character)"
+    return [(filename, report[position]) for position, (filename, _) in enumerate(sheets)]
+
+
+async def import_character_from_bytes(data: bytes) -> str:
+    # /importsheet: parse in the pool, then save. Raises SheetImportError or ValueError with a message for the user.
+    return await asyncio.to_thread(save_character, await parse_sheet(data))
 
 
 def remove_character(name: str):
@@ -157,7 +633,7 @@ def remove_character(name: str):
 def get_character_by_discord(discord_id: str):
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute("SELECT * FROM characters WHERE discord_id = ?", (discord_id,))
+    cur.execute("SELECT * FROM characters WHERE discord_id = ? ORDER BY id LIMIT 1", (discord_id,))
     row = cur.fetchone()
     conn.close()
     return row
@@ -1,8 +1,63 @@
-from sqlalchemy import Column, String, Integer, Boolean
+from fractions import Fraction
+from sqlalchemy import Column, String, Integer, Boolean, Float, Index
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
 
+# Challenge rating text ("1/4", "2", "30") as a number so it can be range-filtered and sorted. Empty values give None.
+def parse_cr(cr):
+    if cr is None:
+        return None
+    cr = str(cr).strip()
+    if not cr:
+        return None
+    try:
+        return float(Fraction(cr))
+    except (ValueError, ZeroDivisionError):
+        raise ValueError(f"'{cr}' is not a challenge rating.") from None
+
+# The shipped monsters table only has CR as text. Add the numeric cr_value column if it's missing and fill any rows that don't have it yet (conn is a sqlite3 connection).
+def ensure_cr_value(conn):
+    columns = {row[1].lower() for row in conn.execute("PRAGMA table_info(monsters)")}
+    if "cr_value" not in columns:
+        conn.execute("ALTER TABLE monsters ADD COLUMN cr_value REAL")
+    rows = conn.execute('SELECT "index", cr FROM monsters WHERE cr_value IS NULL AND cr IS NOT NULL').fetchall()
+    updates = [(parse_cr(cr), index) for index, cr in rows]
+    if updates:
+        conn.executemany('UPDATE monsters SET cr_value = ? WHERE "index" = ?', updates)
+    conn.commit()
+
+# Full-text index over the catalogue for /monster query:. The FTS rowid is the monster's index, and triggers keep it in step with the monsters table.
+MONSTER_FTS_TABLE = "CREATE VIRTUAL TABLE IF NOT EXISTS monsters_fts USING fts5(name, category, source, align, tokenize='unicode61')"
+MONSTER_FTS_TRIGGERS = {
+    "monsters_fts_insert": """CREATE TRIGGER IF NOT EXISTS monsters_fts_insert AFTER INSERT ON monsters BEGIN
+        INSERT INTO monsters_fts(rowid, name, category, source, align) VALUES (new."index", new.name, new.category, new.source, new.align);
+    END""",
+    "monsters_fts_delete": """CREATE TRIGGER IF NOT EXISTS monsters_fts_delete AFTER DELETE ON monsters BEGIN
+        DELETE FROM monsters_fts WHERE rowid = old."index";
+    END""",
+    "monsters_fts_update": """CREATE TRIGGER IF NOT EXISTS monsters_fts_update AFTER UPDATE ON monsters BEGIN
+        DELETE FROM monsters_fts WHERE rowid = old."index";
+        INSERT INTO monsters_fts(rowid, name, category, source, align) VALUES (new."index", new.name, new.category, new.source, new.align);
+    END""",
+}
+
+# Refill the full-text index from the monsters table in one statement.
+def rebuild_monster_fts(conn):
+    conn.execute("DELETE FROM monsters_fts")
+    conn.execute('INSERT INTO monsters_fts(rowid, name, category, source, align) SELECT "index", name, category, source, align FROM monsters')
+
+# Create the full-text index and its triggers if needed (conn is a sqlite3 connection), and rebuild it if it doesn't match the catalogue, e.g. the first run on the shipped DB.
+def ensure_monster_fts(conn):
+    conn.execute(MONSTER_FTS_TABLE)
+    for trigger in MONSTER_FTS_TRIGGERS.values():
+        conn.execute(trigger)
+    indexed = conn.execute("SELECT count(*) FROM monsters_fts").fetchone()[0]
+    total = conn.execute("SELECT count(*) FROM monsters").fetchone()[0]
+    if indexed != total:
+        rebuild_monster_fts(conn)
+    conn.commit()
+
 class Monster(Base):
     __tablename__= "monsters"
 
@@ -10,6 +65,7 @@ class Monster(Base):
     name = Column(String)
     url = Column(String)
     CR = Column(String)
+    cr_value = Column(Float)  # numeric CR, filled from CR when the catalogue is loaded
     category = Column(String)
     size = Column(String)
     AC = Column(Integer)
@@ -24,6 +80,17 @@ class Monster(Base):
     intelligence = Column("int", Integer)
     wisdom = Column("wis", Integer)
     charisma = Column("cha", Integer)
+
+    # Indexes backing the /monster search predicates. The table ships prebuilt, so monster_manual creates any that are missing on startup.
+    __table_args__ = (
+        Index("ix_monsters_name", "name"),
+        Index("ix_monsters_category", "category"),
+        Index("ix_monsters_size", "size"),
+        Index("ix_monsters_ac", "AC"),
+        Index("ix_monsters_hp", "HP"),
+        Index("ix_monsters_cr_value", "cr_value"),
+    )
+
     def __repr__(self):
         return f"Name: {self.name}\nPage URL: {self.url}\nChallenge Rating: {self.CR} Category: {self.category}\nSize: {self.size}\nAC: {self.AC}\nHP: {self.HP}\nSpeed: {self.speed}\nAlignment: {self.alignment}\nLegendary: {self.legendary}\nSource: {self.source}\nSTR: {self.strength}\nDEX: {self.dexterity}\nCON: {self.constitution}\nINT: {self.intelligence}\nWIS: {self.wisdom}\nCHA: {self.charisma}"
     
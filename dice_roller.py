@@ -1,37 +1,510 @@
 import re
-import random
+from collections import OrderedDict
+from functools import lru_cache, wraps
+from math import comb
+from typing import NamedTuple, Optional, Tuple
 
-## Dice roller logic using Regex (Unfortunately) to parse the /roll 4d6+6 to be consistent with
-## DND style dice input. --KH
+import numpy as np
 
-def roll(input):
+import rng_streams
 
-    input = input.lower().replace(' ', '')
-    match = re.match(r'^(\d)d(\d+)([+-]\d)?$', input)
+## Dice roller logic. An expression like /roll 4d6kh3+2 is parsed once into a small AST, which is
+## compiled into a flat "plan" (one sides-array for every die in the expression) and cached per input
+## string. Rolling a plan is a single batched RNG draw, no matter how many terms the expression has.
+##
+## Supported syntax:
+##   d20, 3d8+4         plain dice and modifiers
+##   1d8+2d6+5, 2d6-1d4 any number of dice/constant terms
+##   4d6kh3, 2d20kl1    keep highest/lowest (k is short for kh)
+##   4d6dl1, 5d10dh2    drop lowest/highest
+##   d6!, 3d10!kh2      exploding dice (a max roll adds another roll onto that die)
+##   6x(4d6kh3)         repeat an expression, e.g. for rolling a stat array
 
-    if not match:
-        return None, "Error, use format like '3d2+4' or 'd20'."
+MAX_DICE = 100      # dice per repetition
+MAX_SIDES = 1000
+MAX_REPEAT = 20
+MAX_EXPLODE = 10    # how many times a single die may explode
+MAX_KEEP_WORK = 500_000   # faces * dice^2 budget for the exact keep/drop distribution
 
-    num, sides, modifier = match.groups()
+_TOKEN = re.compile(r"\d+|kh|kl|dh|dl|[dkx!+\-()]")
 
+
+class DiceSyntaxError(ValueError):
+    pass
+
+
+## AST nodes
+class Dice(NamedTuple):
+    count: int
+    sides: int
+    explode: bool = False
+    keep_op: Optional[str] = None   # "kh", "kl", "dh" or "dl" as typed
+    keep_n: int = 0
+
+    @property
+    def keep(self) -> Optional[Tuple[str, int]]:
+        # Drops are normalized to keeps: 4d6dl1 keeps the highest 3. Returns ("h"|"l", n) or None.
+        if self.keep_op is None:
+            return None
+        if self.keep_op == "kh":
+            return "h", self.keep_n
+        if self.keep_op == "kl":
+            return "l", self.keep_n
+        if self.keep_op == "dl":
+            return "h", self.count - self.keep_n
+        return "l", self.count - self.keep_n
+
+    def __str__(self):
+        keep = f"{self.keep_op}{self.keep_n}" if self.keep_op else ""
+        return f"{self.count}d{self.sides}{'!' if self.explode else ''}{keep}"
+
+
+class Const(NamedTuple):
+    value: int
+
+    def __str__(self):
+        return str(self.value)
+
+
+class Sum(NamedTuple):
+    terms: Tuple[Tuple[int, object], ...]   # (sign, Dice | Const)
+
+    def __str__(self):
+        out = ""
+        for i, (sign, node) in enumerate(self.terms):
+            if sign < 0:
+                out += "-"
+            elif i:
+                out += "+"
+            out += str(node)
+        return out
+
+
+class Repeat(NamedTuple):
+    times: int
+    expr: Sum
+
+    def __str__(self):
+        return f"{self.times}x({self.expr})"
+
+
+class _Parser:
+    def __init__(self, text):
+        self.tokens = _TOKEN.findall(text)
+        if "".join(self.tokens) != text:
+            raise DiceSyntaxError(text)
+        self.pos = 0
+
+    def peek(self, offset=0):
+        i = self.pos + offset
+        return self.tokens[i] if i < len(self.tokens) else None
+
+    def take(self, expected=None):
+        tok = self.peek()
+        if tok is None or (expected is not None and tok != expected):
+            raise DiceSyntaxError(tok)
+        self.pos += 1
+        return tok
+
+    def number(self):
+        tok = self.take()
+        if not tok.isdigit():
+            raise DiceSyntaxError(tok)
+        return int(tok)
+
+    def parse(self):
+        if self.peek() and self.peek().isdigit() and self.peek(1) == "x":
+            times = self.number()
+            self.take("x")
+            if self.peek() == "(":
+                self.take("(")
+                expr = self.sum()
+                self.take(")")
+            else:
+                expr = self.sum()
+            node = Repeat(times, expr)
+        else:
+            node = self.sum()
+        if self.peek() is not None:
+            raise DiceSyntaxError(self.peek())
+        return node
+
+    def sum(self):
+        terms = []
+        sign = 1
+        if self.peek() in ("+", "-"):
+            sign = -1 if self.take() == "-" else 1
+        terms.append((sign, self.term()))
+        while self.peek() in ("+", "-"):
+            sign = -1 if self.take() == "-" else 1
+            terms.append((sign, self.term()))
+        return Sum(tuple(terms))
+
+    def term(self):
+        count = 1
+        if self.peek() and self.peek().isdigit():
+            count = self.number()
+            if self.peek() != "d":
+                return Const(count)
+        self.take("d")
+        sides = self.number()
+        explode = False
+        if self.peek() == "!":
+            self.take()
+            explode = True
+        keep_op, keep_n = None, 0
+        if self.peek() in ("k", "kh", "kl", "dh", "dl"):
+            keep_op = self.take()
+            keep_op = "kh" if keep_op == "k" else keep_op
+            keep_n = self.number()
+        return Dice(count, sides, explode, keep_op, keep_n)
+
+
+def _validate(node):
+    repeat = 1
+    if isinstance(node, Repeat):
+        repeat = node.times
+        node = node.expr
+        if not 1 <= repeat <= MAX_REPEAT:
+            raise ValueError(f"Error: You can repeat a roll at most {MAX_REPEAT} times.")
+
+    dice = [n for _, n in node.terms if isinstance(n, Dice)]
+    if sum(d.count for d in dice) > MAX_DICE or any(d.sides > MAX_SIDES for d in dice):
+        raise ValueError("Error: Too many dice or sides.")
+    for d in dice:
+        if d.count < 1 or d.sides < 1:
+            raise ValueError("Error: Invalid numbers in the expression.")
+        if d.explode and d.sides == 1:
+            raise ValueError("Error: A d1 can't explode.")
+        if d.keep_op and not (0 < d.keep[1] <= d.count):
+            raise ValueError(f"Error: Can't {d.keep_op}{d.keep_n} on {d.count} dice.")
+
+
+class DicePlan(NamedTuple):
+    # Compiled form of an expression: every die of one repetition laid out in a single sides array,
+    # with a slice per dice term, so rolling is one vectorized draw.
+    ast: object
+    repeat: int
+    terms: Tuple[Tuple[int, Dice, slice], ...]   # (sign, dice node, slice into sides)
+    sides: np.ndarray
+    explode_mask: np.ndarray
+    constant: int
+
+
+class RollResult(NamedTuple):
+    expression: str
+    totals: Tuple[int, ...]          # one per repetition
+    details: Tuple[str, ...]         # rendered dice for each repetition
+
+
+@lru_cache(maxsize=4096)
+def compile_expression(text: str) -> DicePlan:
+    # Parse + validate + lay out the dice. Raises ValueError with a user-facing message.
     try:
-        num_of_die = int(num) if num else 1
-        sides_of_die = int(sides)
-        die_modifier = 0
+        ast = _Parser(text.lower().replace(" ", "")).parse()
+    except DiceSyntaxError:
+        raise ValueError("Error, use format like '3d2+4', 'd20', '4d6kh3' or '6x(4d6kh3)'.") from None
+    _validate(ast)
+
+    repeat, body = (ast.times, ast.expr) if isinstance(ast, Repeat) else (1, ast)
+    terms = []
+    sides = []
+    explode = []
+    constant = 0
+    for sign, node in body.terms:
+        if isinstance(node, Const):
+            constant += sign * node.value
+            continue
+        start = len(sides)
+        sides.extend([node.sides] * node.count)
+        explode.extend([node.explode] * node.count)
+        terms.append((sign, node, slice(start, len(sides))))
+
+    sides_arr = np.array(sides, dtype=np.int64)
+    explode_arr = np.array(explode, dtype=bool)
+    sides_arr.flags.writeable = False
+    explode_arr.flags.writeable = False
+    return DicePlan(ast, repeat, tuple(terms), sides_arr, explode_arr, constant)
+
 
-        if modifier:
-            die_modifier = int(modifier)
+def _draw(plan: DicePlan, rng) -> np.ndarray:
+    # One draw for the whole expression (shape: repeat x dice), then explosions are compounded onto
+    # the die that rolled max. Only dice that actually exploded are redrawn.
+    rolls = rng.integers(1, plan.sides + 1, size=(plan.repeat, len(plan.sides)))
+    if plan.explode_mask.any():
+        live = (rolls == plan.sides) & plan.explode_mask
+        for _ in range(MAX_EXPLODE):
+            if not live.any():
+                break
+            rows, cols = np.nonzero(live)
+            extra = rng.integers(1, plan.sides[cols] + 1)
+            rolls[rows, cols] += extra
+            live[:] = False
+            live[rows, cols] = extra == plan.sides[cols]
+    return rolls
 
-    except ValueError:
-        return None, "Error: Invalid numbers in the expression."
 
-    if num_of_die > 100 or sides_of_die > 1000:
-        return None, "Error: Too many dice or sides."
+def _render_term(values: np.ndarray, node: Dice) -> Tuple[int, str]:
+    keep = node.keep
+    if keep is None:
+        return int(values.sum()), str(values.tolist())
+    how, n = keep
+    order = np.argsort(values, kind="stable")
+    kept_idx = order[-n:] if how == "h" else order[:n]
+    kept = np.zeros(len(values), dtype=bool)
+    kept[kept_idx] = True
+    shown = [str(v) if k else f"~~{v}~~" for v, k in zip(values.tolist(), kept)]
+    return int(values[kept].sum()), "[" + ", ".join(shown) + "]"
 
-    rolls = [random.randint(1, sides_of_die) for _ in range(num_of_die)]
-    rolls_sum = sum(rolls)
-    total = rolls_sum + die_modifier
 
-    mod = f"{'+' if die_modifier >= 0 else '-'} {abs(die_modifier)}" if die_modifier != 0 else ""
+def evaluate(plan: DicePlan, rng=None) -> RollResult:
+    # rng is anything with Generator.integers semantics, normally the guild's rng_streams stream.
+    rolls = _draw(plan, rng if rng is not None else rng_streams.stream_for())
+    totals = []
+    details = []
+    for row in rolls:
+        total = plan.constant
+        parts = []
+        for sign, node, sl in plan.terms:
+            value, text = _render_term(row[sl], node)
+            total += sign * value
+            parts.append(("-" if sign < 0 else "") + text)
+        totals.append(total)
+        details.append(" ".join(parts))
+    return RollResult(str(plan.ast), tuple(totals), tuple(details))
+
+
+def roll(input, rng=None):
+    try:
+        plan = compile_expression(input)
+    except ValueError as e:
+        return str(e)
+
+    result = evaluate(plan, rng)
+
+    if plan.repeat == 1:
+        return f"Rolls {result.expression}: {result.details[0]} Total: {result.totals[0]}"
+    return f"Rolls {result.expression}: {list(result.totals)}"
+
+
+## Exact statistics for /rollstats. Every expression is turned into its full probability distribution by
+## polynomial convolution: a distribution is (offset, pmf) where pmf[i] = P(total == offset + i). Per-die and
+## per-"NdS" distributions are memoized (within a memory budget), so 20d12 is built once and reused by every
+## expression that has it.
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# Memory budgets for the memoized distributions. The keys come straight from user input and one pmf can be
+# megabytes (100d1000! is over a million entries), so each cache is an LRU bounded by bytes, not entries.
+DIE_CACHE_BYTES = 8 * 2**20
+POWER_CACHE_BYTES = 24 * 2**20
+KEEP_CACHE_BYTES = 8 * 2**20
+DISTRIBUTION_CACHE_BYTES = 16 * 2**20
+
+
+def _pmf_bytes(value) -> int:
+    pmf = value[1] if isinstance(value, tuple) else value
+    return pmf.nbytes
+
+
+def _bounded_cache(max_bytes: int):
+    # lru_cache, but evicting by the total size of the cached pmfs. A result bigger than a quarter of the
+    # budget is returned without being cached, so one huge roll can't flush everything else.
+    def decorate(fn):
+        entries: "OrderedDict[tuple, object]" = OrderedDict()
+        used = [0]
+
+        @wraps(fn)
+        def wrapper(*args):
+            value = entries.get(args)
+            if value is not None:
+                entries.move_to_end(args)
+                return value
+            value = fn(*args)
+            size = _pmf_bytes(value)
+            if size <= max_bytes // 4:
+                entries[args] = value
+                used[0] += size
+                while used[0] > max_bytes:
+                    _, old = entries.popitem(last=False)
+                    used[0] -= _pmf_bytes(old)
+            return value
+
+        def cache_info():
+            return {"entries": len(entries), "bytes": used[0], "max_bytes": max_bytes}
+
+        def cache_clear():
+            entries.clear()
+            used[0] = 0
+
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return decorate
+
+
+class RollStats(NamedTuple):
+    expression: str
+    repeat: int
+    minimum: int
+    maximum: int
+    mean: float
+    variance: float
+    percentiles: Tuple[Tuple[int, int], ...]   # (percentile, total)
+    dc: Optional[int] = None
+    p_success: Optional[float] = None          # P(total >= dc)
+
+    @property
+    def stddev(self) -> float:
+        return self.variance ** 0.5
+
+
+def _convolve(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # Direct convolution for small inputs, FFT for big ones (exploding d100s etc.).
+    if len(a) * len(b) <= 250_000:
+        return np.convolve(a, b)
+    n = len(a) + len(b) - 1
+    size = 1 << (n - 1).bit_length()
+    out = np.fft.irfft(np.fft.rfft(a, size) * np.fft.rfft(b, size), size)[:n]
+    return np.clip(out, 0.0, None)
+
+
+@_bounded_cache(DIE_CACHE_BYTES)
+def _die_pmf(sides: int, explode: bool) -> np.ndarray:
+    # pmf of a single die indexed by face value (pmf[0] is always 0). Exploding dice follow the roller:
+    # a max roll adds another roll, at most MAX_EXPLODE times.
+    if not explode:
+        pmf = np.full(sides + 1, 1.0 / sides)
+        pmf[0] = 0.0
+    else:
+        pmf = np.zeros(sides * (MAX_EXPLODE + 1) + 1)
+        for chain in range(MAX_EXPLODE + 1):
+            last = chain == MAX_EXPLODE
+            faces = np.arange(1, sides + 1 if last else sides)
+            pmf[chain * sides + faces] = (1.0 / sides) ** (chain + 1)
+    pmf.flags.writeable = False
+    return pmf
+
+
+@_bounded_cache(POWER_CACHE_BYTES)
+def _dice_pmf(count: int, sides: int, explode: bool) -> np.ndarray:
+    # NdS as die^N, split in halves so every partial power lands in the cache.
+    if count == 1:
+        return _die_pmf(sides, explode)
+    half = count // 2
+    pmf = _convolve(_dice_pmf(half, sides, explode), _dice_pmf(count - half, sides, explode))
+    pmf.flags.writeable = False
+    return pmf
+
+
+@_bounded_cache(KEEP_CACHE_BYTES)
+def _keep_pmf(count: int, sides: int, explode: bool, how: str, n: int) -> np.ndarray:
+    # Distribution of the sum of the n highest (or lowest) of count dice. Walk the faces from the kept end;
+    # ways[used] is the distribution of the kept sum after `used` dice have been assigned a face. Choosing j
+    # of the remaining dice to show face v has weight C(remaining, j) * p(v)^j, and only the first n dice
+    # assigned are kept.
+    die = _die_pmf(sides, explode)
+    faces = np.nonzero(die)[0]
+    if how == "h":
+        faces = faces[::-1]
+    if len(faces) * (count + 1) ** 2 > MAX_KEEP_WORK:
+        raise ValueError("Error: That keep/drop roll is too big to compute exactly.")
+
+    width = n * int(faces.max()) + 1
+    ways = np.zeros((count + 1, width))
+    ways[0, 0] = 1.0
+    for v in faces:
+        p = die[v]
+        new = np.zeros_like(ways)
+        for used in range(count + 1):
+            row = ways[used]
+            if not row.any():
+                continue
+            room = n - min(used, n)
+            weight = 1.0
+            for j in range(count - used + 1):
+                shift = min(j, room) * v
+                w = comb(count - used, j) * weight
+                if shift:
+                    new[used + j, shift:] += row[:width - shift] * w
+                else:
+                    new[used + j] += row * w
+                weight *= p
+        ways = new
+    pmf = ways[count]
+    pmf.flags.writeable = False
+    return pmf
+
+
+def _term_distribution(node: Dice) -> Tuple[int, np.ndarray]:
+    # (lowest possible total, pmf) for one dice term. The pmf is indexed by total, so the highest
+    # possible total is len(pmf) - 1.
+    keep = node.keep
+    if keep is None:
+        return node.count, _dice_pmf(node.count, node.sides, node.explode)
+    return keep[1], _keep_pmf(node.count, node.sides, node.explode, keep[0], keep[1])
+
+
+@_bounded_cache(DISTRIBUTION_CACHE_BYTES)
+def distribution(text: str) -> Tuple[int, np.ndarray]:
+    # Exact distribution of one repetition of an expression as (offset, pmf). The support is tracked from
+    # the terms themselves rather than read off the pmf, since the far tails of big rolls (1/1000^100 for
+    # 100d1000 rolling all ones) underflow to 0.
+    plan = compile_expression(text)
+    offset = plan.constant
+    lo = hi = 0
+    pmf = np.ones(1)
+    for sign, node, _ in plan.terms:
+        term_lo, term_pmf = _term_distribution(node)
+        term_hi = len(term_pmf) - 1
+        if sign < 0:
+            offset -= term_hi
+            lo -= term_hi
+            hi -= term_lo
+            term_pmf = term_pmf[::-1]
+        else:
+            lo += term_lo
+            hi += term_hi
+        pmf = _convolve(pmf, term_pmf)
+
+    # pmf is indexed from `offset`; cut it down to the totals that can actually be rolled
+    pmf = pmf[lo - (offset - plan.constant):hi - (offset - plan.constant) + 1]
+    pmf = pmf / pmf.sum()
+    pmf.flags.writeable = False
+    return plan.constant + lo, pmf
+
+
+def roll_stats(input, dc: Optional[int] = None) -> RollStats:
+    plan = compile_expression(input)
+    offset, pmf = distribution(input)
+    totals = np.arange(offset, offset + len(pmf))
+    mean = float(totals @ pmf)
+    variance = float(((totals - mean) ** 2) @ pmf)
+    cdf = np.cumsum(pmf)
+    cuts = np.searchsorted(cdf, np.array(PERCENTILES) / 100.0 - 1e-12)
+    percentiles = tuple((q, int(totals[min(i, len(totals) - 1)])) for q, i in zip(PERCENTILES, cuts))
+
+    p_success = None
+    if dc is not None:
+        start = min(max(dc - offset, 0), len(pmf))
+        p_success = float(pmf[start:].sum())
+
+    return RollStats(str(plan.ast), plan.repeat, offset, offset + len(pmf) - 1, mean, variance, percentiles, dc, p_success)
+
+
+def stats(input, dc: Optional[int] = None):
+    # Discord-friendly text for /rollstats.
+    try:
+        s = roll_stats(input, dc)
+    except ValueError as e:
+        return str(e)
 
-    return f"Rolls {num_of_die}d{sides_of_die}{mod}: {rolls} Total: {total}"
\ No newline at end of file
+    each = f" (each of {s.repeat} rolls)" if s.repeat > 1 else ""
+    lines = [
+        f"Stats for {s.expression}{each}:",
+        f"Range: {s.minimum} to {s.maximum} | Mean: {s.mean:.2f} | Std Dev: {s.stddev:.2f} | Variance: {s.variance:.2f}",
+        "Percentiles: " + ", ".join(f"p{q}={v}" for q, v in s.percentiles),
+    ]
+    if s.dc is not None:
+        lines.append(f"Chance to meet DC {s.dc}: {s.p_success * 100:.1f}%")
+    return "\n".join(lines)
@@ -0,0 +1,227 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import discord
+import numpy as np
+
+import rng_streams
+from monster_index import QueryCache
+from monster_manual import ListCursor, MonsterFilter, matching_ids, menu_nav, monster_embed, snapshots
+
+# Encounter builder for /encounter, following the 5e DMG encounter rules: the party's XP budget comes from
+# the per-level thresholds, and a group of monsters is judged by its total XP times a multiplier for how
+# many monsters there are. Candidate groups are found with a bounded knapsack over the catalogue bucketed
+# by CR, then filled in with random monsters from each bucket.
+
+DIFFICULTIES = ("easy", "medium", "hard", "deadly")
+
+# Per-character XP thresholds by level: easy, medium, hard, deadly
+XP_THRESHOLDS = {
+    1: (25, 50, 75, 100),
+    2: (50, 100, 150, 200),
+    3: (75, 150, 225, 400),
+    4: (125, 250, 375, 500),
+    5: (250, 500, 750, 1100),
+    6: (300, 600, 900, 1400),
+    7: (350, 750, 1100, 1700),
+    8: (450, 900, 1400, 2100),
+    9: (550, 1100, 1600, 2400),
+    10: (600, 1200, 1900, 2800),
+    11: (800, 1600, 2400, 3600),
+    12: (1000, 2000, 3000, 4500),
+    13: (1100, 2200, 3400, 5100),
+    14: (1250, 2500, 3800, 5700),
+    15: (1400, 2800, 4300, 6400),
+    16: (1600, 3200, 4800, 7200),
+    17: (2000, 3900, 5900, 8800),
+    18: (2100, 4200, 6300, 9500),
+    19: (2400, 4900, 7300, 10900),
+    20: (2800, 5700, 8500, 12700),
+}
+
+CR_XP = {
+    0: 10, 0.125: 25, 0.25: 50, 0.5: 100, 1: 200, 2: 450, 3: 700, 4: 1100, 5: 1800, 6: 2300, 7: 2900,
+    8: 3900, 9: 5000, 10: 5900, 11: 7200, 12: 8400, 13: 10000, 14: 11500, 15: 13000, 16: 15000,
+    17: 18000, 18: 20000, 19: 22000, 20: 25000, 21: 33000, 22: 41000, 23: 50000, 24: 62000,
+    25: 75000, 26: 90000, 27: 105000, 28: 120000, 29: 135000, 30: 155000,
+}
+
+# Encounter multipliers, indexed by step. 1 monster is step 1, 2 is step 2, 3-6 step 3, 7-10 step 4,
+# 11-14 step 5, 15+ step 6. Small parties (1-2) move a step up, big ones (6+) a step down.
+MULTIPLIER_STEPS = (0.5, 1, 1.5, 2, 2.5, 3, 4, 5)
+
+MAX_MONSTERS = 8        # monsters in one encounter
+MAX_GROUPS = 3          # different kinds of monster in one encounter
+MAX_PER_STATE = 2       # combinations kept per (monsters, groups, xp step) knapsack state
+XP_STEPS = 200          # raw XP resolution of the knapsack table
+MIN_SHARE = 40          # ignore monsters worth less than 1/MIN_SHARE of the budget; they are just noise at that level
+
+
+@dataclass(frozen=True)
+class Encounter:
+    difficulty: str
+    groups: Tuple[Tuple[int, int], ...]   # (monster index, how many)
+    xp: int                               # raw XP, what the party is awarded
+    adjusted_xp: int                      # XP times the group-size multiplier, what the difficulty is judged on
+
+    @property
+    def monster_ids(self) -> List[int]:
+        return [index for index, _ in self.groups]
+
+    @property
+    def size(self) -> int:
+        return sum(count for _, count in self.groups)
+
+
+def multiplier(monsters: int, party_size: int) -> float:
+    if monsters <= 0:
+        return 0.0
+    if monsters == 1:
+        step = 1
+    elif monsters == 2:
+        step = 2
+    elif monsters <= 6:
+        step = 3
+    elif monsters <= 10:
+        step = 4
+    elif monsters <= 14:
+        step = 5
+    else:
+        step = 6
+    if party_size < 3:
+        step += 1
+    elif party_size >= 6:
+        step -= 1
+    return MULTIPLIER_STEPS[step]
+
+
+def xp_budget(party_size: int, level: int, difficulty: str) -> Tuple[int, int]:
+    # Adjusted XP window for a difficulty: from its threshold up to the next one (deadly tops out at 1.5x).
+    level = max(1, min(20, level))
+    d = DIFFICULTIES.index(difficulty)
+    low = XP_THRESHOLDS[level][d] * party_size
+    if d + 1 < len(DIFFICULTIES):
+        high = XP_THRESHOLDS[level][d + 1] * party_size - 1
+    else:
+        high = int(low * 1.5)
+    return low, high
+
+
+# Monster indexes bucketed by CR for a search, rebuilt only when the catalogue changes.
+_bucket_cache = QueryCache(maxsize=64, ttl=600.0)
+snapshots.add_refresh_listener(lambda snapshot: _bucket_cache.clear())
+
+
+def cr_buckets(filters: MonsterFilter) -> Dict[float, np.ndarray]:
+    buckets = _bucket_cache.get(filters)
+    if buckets is None:
+        snapshot = snapshots.current()
+        ids = matching_ids(filters)
+        crs = snapshot.cr[np.searchsorted(snapshot.ids, ids)]
+        buckets = {}
+        for cr in CR_XP:
+            bucket = ids[crs == cr]
+            if len(bucket):
+                buckets[cr] = bucket
+        _bucket_cache.put(filters, buckets)
+    return buckets
+
+
+def _knapsack(crs: List[float], raw_cap: int):
+    # Bounded knapsack over CR buckets. A state is (monsters, groups, raw xp); each CR can be used once as a
+    # group of 1..MAX_MONSTERS monsters. Raw XP is bucketed into XP_STEPS steps of the cap for the state key
+    # (the exact total rides along with each combination), and at most MAX_PER_STATE combinations are kept
+    # per state, so the table stays a few thousand entries no matter how big the budget is.
+    quantum = max(1, raw_cap // XP_STEPS)
+    states: Dict[Tuple[int, int, int], List[Tuple[Tuple[Tuple[float, int], ...], int]]] = {(0, 0, 0): [((), 0)]}
+    for cr in crs:
+        xp = CR_XP[cr]
+        additions = {}
+        for (monsters, groups, _), combos in states.items():
+            if groups == MAX_GROUPS:
+                continue
+            for combo, total in combos:
+                for count in range(1, MAX_MONSTERS - monsters + 1):
+                    new_total = total + count * xp
+                    if new_total > raw_cap:
+                        break
+                    key = (monsters + count, groups + 1, new_total // quantum)
+                    bucket = additions.get(key)
+                    if bucket is None:
+                        bucket = additions[key] = states.get(key, [])[:]
+                    if len(bucket) < MAX_PER_STATE:
+                        bucket.append((combo + ((cr, count),), new_total))
+        states.update(additions)
+    return states
+
+
+def build_encounters(party_size: int, level: int, difficulty: str = "medium", filters: Optional[MonsterFilter] = None,
+                     count: int = 5, rng=None) -> List[Encounter]:
+    # Several candidate encounters for the party, each a different mix of CR groups inside the budget.
+    difficulty = difficulty.lower()
+    if difficulty not in DIFFICULTIES:
+        raise ValueError(f"Difficulty must be one of: {', '.join(DIFFICULTIES)}.")
+    if party_size < 1:
+        raise ValueError("The party needs at least one player.")
+    if rng is None:
+        rng = rng_streams.stream_for()
+
+    buckets = cr_buckets(filters or MonsterFilter())
+    low, high = xp_budget(party_size, level, difficulty)
+    raw_cap = int(high / multiplier(1, party_size))
+    crs = sorted(cr for cr in buckets if low / MIN_SHARE <= CR_XP[cr] <= raw_cap)
+
+    fits = []
+    for (monsters, _, _), combos in _knapsack(crs, raw_cap).items():
+        for combo, total in combos:
+            adjusted = total * multiplier(monsters, party_size)
+            if low <= adjusted <= high:
+                fits.append((combo, total, int(adjusted)))
+    if not fits:
+        return []
+
+    encounters = []
+    picks = np.argsort(rng.uniforms(len(fits)))[:count]
+    for pick in picks:
+        combo, total, adjusted = fits[pick]
+        groups = tuple(
+            (int(buckets[cr][rng.integers(0, len(buckets[cr]))]), n) for cr, n in combo
+        )
+        encounters.append(Encounter(difficulty, groups, total, adjusted))
+    encounters.sort(key=lambda e: e.adjusted_xp)
+    return encounters
+
+
+def describe_encounter(encounter: Encounter) -> str:
+    snapshot = snapshots.current()
+    parts = []
+    for index, n in encounter.groups:
+        monster = snapshot.record(index)
+        parts.append(f"{n}x {monster.name.replace('-', ' ').title()} (CR {monster.CR})")
+    return f"{', '.join(parts)} — {encounter.xp} XP ({encounter.adjusted_xp} adjusted)"
+
+
+# Pages through the monsters of every candidate encounter with the regular monster menu, plus a button that logs the whole encounter the current monster belongs to.
+class encounter_nav(menu_nav):
+    def __init__(self, encounters: List[Encounter], ctx, tracker):
+        super().__init__(ListCursor([index for e in encounters for index in e.monster_ids]), ctx, tracker)
+        self.owners = [e for e in encounters for _ in e.groups]
+
+    @discord.ui.button(label="Log Encounter", style=discord.ButtonStyle.secondary)
+    async def track_encounter(self, interaction, button):
+        await interaction.response.defer()
+        if not self.tracker.get_active_session(self.ctx.guild.id):
+            await interaction.followup.send("Unable to track encounter: No session is currently active.", ephemeral=True)
+            return
+        snapshot = snapshots.current()
+        monsters = [snapshot.record(index) for index, n in self.owners[self.cursor.page].groups for _ in range(n)]
+        self.tracker.record_monster(self.ctx.guild.id, self.ctx.user.name, monsters)
+        await interaction.followup.send("Successfully tracked the encounter to session log.", ephemeral=True)
+
+
+async def display_encounters(ctx, encounters: List[Encounter], tracker, reveal):
+    lines = [f"**{encounters[0].difficulty.title()} encounters:**"]
+    lines += [f"{i}. {describe_encounter(e)}" for i, e in enumerate(encounters, start=1)]
+    view = encounter_nav(encounters, ctx, tracker)
+    first_monster = monster_embed(view.cursor.first())
+    await ctx.response.send_message("\n".join(lines), embed=first_monster, view=view, ephemeral=reveal != "Yes")
@@ -0,0 +1,332 @@
+import argparse
+import csv
+import json
+import sqlite3
+import time
+from itertools import islice
+
+from sqlalchemy.dialects import sqlite as sqlite_dialect
+from sqlalchemy.schema import CreateIndex
+
+from data.monsters import Monster, parse_cr, ensure_cr_value, ensure_monster_fts, rebuild_monster_fts, MONSTER_FTS_TRIGGERS
+
+## Bulk loader for the monster and weapon catalogues. Source files (CSV, JSON or JSON lines) are streamed row by
+## row through normalize -> dedupe -> batch, and every batch goes in with one executemany, all inside a single
+## transaction per file. The search indexes and FTS triggers are dropped for the load and rebuilt once at the end,
+## so memory stays bounded by the batch size and a big homebrew file is a few seconds instead of an ORM add per row.
+##
+##   python ingest.py monsters homebrew.csv
+##   python ingest.py weapons items.json --db data/Weapons.db
+##
+## Rows are matched on name: a name that's already in the catalogue is updated in place (blank fields are left alone),
+## anything else is added.
+
+BATCH_SIZE = 1000
+
+MONSTER_DB = "data/monsters.db"
+WEAPON_DB = "data/Weapons.db"
+
+# Same layout as the shipped monsters table, for loading into a fresh DB.
+MONSTER_TABLE = """CREATE TABLE IF NOT EXISTS monsters (
+    "index" BIGINT, name TEXT, url TEXT, cr TEXT, category TEXT, size TEXT, ac BIGINT, hp BIGINT, speed TEXT,
+    align TEXT, legendary TEXT, source TEXT, str FLOAT, dex FLOAT, con FLOAT, int FLOAT, wis FLOAT, cha FLOAT,
+    cr_value REAL
+)"""
+
+WEAPON_TABLE = """CREATE TABLE IF NOT EXISTS "Weapons_DB_Import" (
+    "WeaponID" INTEGER,
+    "Name" TEXT,
+    "Rarity" TEXT,
+    "Type" TEXT,
+    "Magic" INTEGER,
+    PRIMARY KEY("WeaponID")
+)"""
+
+# Column names as they come in from the source -> our column. Anything not listed here is ignored.
+MONSTER_ALIASES = {
+    "name": "name", "url": "url", "cr": "cr", "challenge": "cr", "challenge_rating": "cr",
+    "type": "category", "category": "category", "size": "size", "ac": "ac", "armor_class": "ac",
+    "hp": "hp", "hit_points": "hp", "speed": "speed", "align": "align", "alignment": "align",
+    "legendary": "legendary", "source": "source",
+    "str": "str", "strength": "str", "dex": "dex", "dexterity": "dex", "con": "con", "constitution": "con",
+    "int": "int", "intelligence": "int", "wis": "wis", "wisdom": "wis", "cha": "cha", "charisma": "cha",
+}
+MONSTER_COLUMNS = ("name", "url", "cr", "category", "size", "ac", "hp", "speed", "align", "legendary", "source",
+                   "str", "dex", "con", "int", "wis", "cha", "cr_value")
+LEGENDARY = MONSTER_COLUMNS.index("legendary")
+
+WEAPON_ALIASES = {"name": "Name", "rarity": "Rarity", "type": "Type", "category": "Type", "magic": "Magic"}
+WEAPON_COLUMNS = ("Rarity", "Type", "Magic")
+WEAPON_DEFAULTS = {"Rarity": "COMMON", "Type": "OTHER", "Magic": 0}
+
+TRUE_WORDS = ("1", "true", "yes", "y", "legendary")
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+# Source rows as dicts, one at a time. CSV and .jsonl are read line by line; a .json file has to be a list of objects.
+def read_rows(path):
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            yield from csv.DictReader(f)
+    elif path.lower().endswith((".jsonl", ".ndjson")):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            yield from json.load(f)
+    else:
+        raise ValueError(f"Don't know how to read '{path}'. Use a .csv, .json or .jsonl file.")
+
+
+def _rename(row, aliases):
+    out = {}
+    for key, value in row.items():
+        column = aliases.get(str(key).strip().lower().replace(" ", "_"))
+        if column is not None and column not in out:
+            out[column] = value.strip() if isinstance(value, str) else value
+    return out
+
+
+def _text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _number(value, cast):
+    value = _text(value)
+    if value is None or value.lower() == "nan":
+        return None
+    try:
+        return cast(float(value.split()[0]))
+    except ValueError:
+        raise InvalidRow(f"'{value}' is not a number") from None
+
+
+def _flag(value):
+    value = _text(value)
+    return value is not None and value.lower() in TRUE_WORDS
+
+
+# Like _flag, but a blank cell is None so an update leaves the stored value alone.
+def _optional_flag(value):
+    if _text(value) is None:
+        return None
+    return "1" if _flag(value) else "0"
+
+
+def normalize_monster(row):
+    row = _rename(row, MONSTER_ALIASES)
+    name = _text(row.get("name"))
+    if name is None:
+        raise InvalidRow("monster has no name")
+    cr = _text(row.get("cr"))
+    try:
+        cr_value = parse_cr(cr)
+    except ValueError as e:
+        raise InvalidRow(str(e)) from None
+    return {
+        # names are stored lowercase and hyphenated, the same way /monster looks them up
+        "name": "-".join(name.lower().split()),
+        "url": _text(row.get("url")),
+        "cr": cr,
+        "category": _text(row.get("category")),
+        "size": _text(row.get("size")),
+        "ac": _number(row.get("ac"), int),
+        "hp": _number(row.get("hp"), int),
+        "speed": _text(row.get("speed")),
+        "align": _text(row.get("align")),
+        # legendary has always been the text '0'/'1' in this table; blank is None here and '0' on insert
+        "legendary": _optional_flag(row.get("legendary")),
+        "source": _text(row.get("source")),
+        "str": _number(row.get("str"), float),
+        "dex": _number(row.get("dex"), float),
+        "con": _number(row.get("con"), float),
+        "int": _number(row.get("int"), float),
+        "wis": _number(row.get("wis"), float),
+        "cha": _number(row.get("cha"), float),
+        "cr_value": cr_value,
+    }
+
+
+def normalize_weapon(row):
+    row = _rename(row, WEAPON_ALIASES)
+    name = _text(row.get("Name"))
+    if name is None:
+        raise InvalidRow("item has no name")
+    rarity = _text(row.get("Rarity"))
+    magic = row.get("Magic")
+    # blank cells are None, so an update leaves them alone; WEAPON_DEFAULTS fills them in on insert
+    return {
+        "Name": name,
+        # same spelling the loot tables use: COMMON, VERY_RARE, ...
+        "Rarity": "_".join(rarity.upper().split()) if rarity else None,
+        "Type": _text(row.get("Type")),
+        "Magic": None if _text(magic) is None else 1 if _flag(magic) else 0,
+    }
+
+
+class IngestStats:
+    def __init__(self):
+        self.read = 0
+        self.invalid = 0
+        self.duplicates = 0
+        self.inserted = 0
+        self.updated = 0
+
+    def __str__(self):
+        return (f"{self.read} rows read: {self.inserted} added, {self.updated} updated, "
+                f"{self.duplicates} duplicates, {self.invalid} invalid")
+
+
+def normalized(rows, normalize, stats):
+    for number, row in enumerate(rows, start=1):
+        stats.read += 1
+        try:
+            yield normalize(row)
+        except InvalidRow as e:
+            stats.invalid += 1
+            print(f"  skipping row {number}: {e}")
+
+
+# Only the first row for each key gets through. Keeps a set of keys, not the rows.
+def dedupe(rows, key, stats):
+    seen = set()
+    for row in rows:
+        k = key(row)
+        if k in seen:
+            stats.duplicates += 1
+            continue
+        seen.add(k)
+        yield row
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _index_ddl(table):
+    return [str(CreateIndex(index, if_not_exists=True).compile(dialect=sqlite_dialect.dialect())) for index in table.indexes]
+
+
+def ingest_monsters(path, db=MONSTER_DB, batch_size=BATCH_SIZE):
+    stats = IngestStats()
+    conn = sqlite3.connect(db, isolation_level=None)
+    try:
+        conn.execute(MONSTER_TABLE)
+        ensure_cr_value(conn)
+        ensure_monster_fts(conn)
+
+        conn.execute("BEGIN")
+        # per-row FTS triggers and index maintenance are the slow part of a big load, so do them once at the end
+        for trigger in MONSTER_FTS_TRIGGERS:
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        for index in Monster.__table__.indexes:
+            conn.execute(f"DROP INDEX IF EXISTS {index.name}")
+
+        columns = ", ".join(f'"{c}"' for c in MONSTER_COLUMNS)
+        existing = dict(conn.execute('SELECT name, "index" FROM monsters'))
+        next_index = conn.execute('SELECT coalesce(max("index"), -1) + 1 FROM monsters').fetchone()[0]
+        placeholders = ", ".join("?" for _ in MONSTER_COLUMNS)
+        insert = f'INSERT INTO monsters ("index", {columns}) VALUES (?, {placeholders})'
+        # a column the source leaves blank keeps what's already there
+        assignments = ", ".join(f'"{c}" = coalesce(?, "{c}")' for c in MONSTER_COLUMNS)
+        update = f'UPDATE monsters SET {assignments} WHERE "index" = ?'
+
+        rows = dedupe(normalized(read_rows(path), normalize_monster, stats), lambda r: r["name"], stats)
+        for batch in batched(rows, batch_size):
+            inserts, updates = [], []
+            for row in batch:
+                values = [row[c] for c in MONSTER_COLUMNS]
+                index = existing.get(row["name"])
+                if index is None:
+                    if row["legendary"] is None:
+                        values[LEGENDARY] = "0"
+                    inserts.append([next_index] + values)
+                    next_index += 1
+                else:
+                    updates.append(values + [index])
+            conn.executemany(insert, inserts)
+            conn.executemany(update, updates)
+            stats.inserted += len(inserts)
+            stats.updated += len(updates)
+
+        for ddl in _index_ddl(Monster.__table__):
+            conn.execute(ddl)
+        rebuild_monster_fts(conn)
+        for trigger in MONSTER_FTS_TRIGGERS.values():
+            conn.execute(trigger)
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return stats
+
+
+def ingest_weapons(path, db=WEAPON_DB, batch_size=BATCH_SIZE):
+    stats = IngestStats()
+    conn = sqlite3.connect(db, isolation_level=None)
+    try:
+        conn.execute(WEAPON_TABLE)
+        conn.execute("BEGIN")
+        existing = {name.lower(): weapon_id for weapon_id, name in conn.execute('SELECT "WeaponID", "Name" FROM "Weapons_DB_Import"')}
+        insert = 'INSERT INTO "Weapons_DB_Import" ("Name", "Rarity", "Type", "Magic") VALUES (?, ?, ?, ?)'
+        # a column the source leaves blank keeps what's already there
+        assignments = ", ".join(f'"{c}" = coalesce(?, "{c}")' for c in WEAPON_COLUMNS)
+        update = f'UPDATE "Weapons_DB_Import" SET {assignments} WHERE "WeaponID" = ?'
+
+        rows = dedupe(normalized(read_rows(path), normalize_weapon, stats), lambda r: r["Name"].lower(), stats)
+        for batch in batched(rows, batch_size):
+            inserts, updates = [], []
+            for row in batch:
+                weapon_id = existing.get(row["Name"].lower())
+                if weapon_id is None:
+                    inserts.append([row["Name"]] + [WEAPON_DEFAULTS[c] if row[c] is None else row[c] for c in WEAPON_COLUMNS])
+                else:
+                    updates.append([row[c] for c in WEAPON_COLUMNS] + [weapon_id])
+            conn.executemany(insert, inserts)
+            conn.executemany(update, updates)
+            stats.inserted += len(inserts)
+            stats.updated += len(updates)
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk load monsters or items into the catalogue DBs.")
+    parser.add_argument("catalogue", choices=("monsters", "weapons"))
+    parser.add_argument("path", help="CSV, JSON or JSON lines file to load")
+    parser.add_argument("--db", help="DB to load into (defaults to the bot's own DB for that catalogue)")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="rows per executemany")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.catalogue == "monsters":
+        stats = ingest_monsters(args.path, args.db or MONSTER_DB, args.batch)
+    else:
+        stats = ingest_weapons(args.path, args.db or WEAPON_DB, args.batch)
+    print(f"{args.catalogue}: {stats} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
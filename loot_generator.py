@@ -1,8 +1,14 @@
-import random
 from dataclasses import dataclass
-from typing import List, Optional
-from sqlalchemy import create_engine, Integer, String, Column, ForeignKey, DateTime, func
+from collections import Counter
+import os
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+from sqlalchemy import create_engine, Integer, String, Column, ForeignKey, DateTime, Index, func, text, select, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
+import discord
+import numpy as np
+import rng_streams
 
 # Data Model
 
@@ -14,8 +20,16 @@ class Item:
     type: str               # "weapon", "armor", "potion", "gear", etc.
     magic: bool = False
 
+
+@dataclass
+class InventoryStack:
+    # One line of /inventory: an item and how many of it the user has.
+    item: Item
+    quantity: int
+
 # Open the Weapons Database - AM
-DATABASE_URL = "sqlite:///data/Weapons.db"
+DB_PATH = "data/Weapons.db"
+DATABASE_URL = f"sqlite:///{DB_PATH}"
 
 engine = create_engine(DATABASE_URL, echo=False, future=True)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
@@ -47,15 +61,39 @@ class InventoryModel(Base):
 
     weapon = relationship("WeaponModel")
 
+    # One stack per user + weapon, so a repeat drop bumps Quantity instead of adding a row.
+    __table_args__ = (Index("ux_inventory_user_weapon", "DiscordID", "WeaponID", unique=True),)
+
 Base.metadata.create_all(engine)
 
+
+def _migrate_inventory_stacks() -> None:
+    # Inventories written before stacking have one row per drop. Fold those into a single stack per user + weapon
+    # (keeping the oldest row) and then add the unique index the upsert needs. create_all won't add it to an
+    # existing table.
+    with engine.begin() as conn:
+        conn.execute(text(
+            'UPDATE "Inventory" SET "Quantity" = (SELECT sum(i."Quantity") FROM "Inventory" i '
+            'WHERE i."DiscordID" = "Inventory"."DiscordID" AND i."WeaponID" = "Inventory"."WeaponID") '
+            'WHERE "InventoryID" IN (SELECT min("InventoryID") FROM "Inventory" GROUP BY "DiscordID", "WeaponID" HAVING count(*) > 1)'
+        ))
+        conn.execute(text(
+            'DELETE FROM "Inventory" WHERE "InventoryID" NOT IN '
+            '(SELECT min("InventoryID") FROM "Inventory" GROUP BY "DiscordID", "WeaponID")'
+        ))
+    for index in InventoryModel.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+
+_migrate_inventory_stacks()
+
 # Helpers for normalizing db values - AM
 
 def _normalize_rarity(r: Optional[str]) -> str:
     if not r:
         return "common"
     r = r.strip().lower()
-    return r.replace(" ", "-")  # "VERY RARE" -> "very-rare" - AM
+    return r.replace(" ", "-").replace("_", "-")  # "VERY RARE" / "VERY_RARE" -> "very-rare" - AM
 
 
 def _normalize_type(t: Optional[str]) -> str:
@@ -86,7 +124,144 @@ def _load_items_from_db() -> List[Item]:
         session.close()
 
 
-ITEMS: List[Item] = _load_items_from_db()  
+# Items grouped by (rarity, type, magic only) so random_item is one dict lookup instead of filtering every item on
+# every draw. type None means any type. Magic items are filed under both magic_only=False and magic_only=True.
+def build_item_index(items: Sequence[Item]) -> Dict[Tuple[str, Optional[str], bool], Tuple[Item, ...]]:
+    index: Dict[Tuple[str, Optional[str], bool], List[Item]] = {}
+    for item in items:
+        for magic_only in ((False, True) if item.magic else (False,)):
+            index.setdefault((item.rarity, item.type, magic_only), []).append(item)
+            index.setdefault((item.rarity, None, magic_only), []).append(item)
+    return {key: tuple(pool) for key, pool in index.items()}
+
+
+# Treasure hoard tiers, DMG style: what was defeated (its CR) or who beat it (party level) decides how good the loot
+# is. Each tier has its own rarity weights and items per party member.
+class HoardTier(NamedTuple):
+    name: str
+    max_level: Optional[int]         # highest CR / party level in this tier, None for the last one
+    items: Tuple[int, int]           # (fewest, most) items per party member
+    weights: Dict[str, int]
+
+
+HOARD_TIERS = (
+    HoardTier("CR 0-4", 4, (1, 2), {"common": 60, "uncommon": 30, "rare": 9, "very-rare": 1, "legendary": 0}),
+    HoardTier("CR 5-10", 10, (1, 3), {"common": 30, "uncommon": 40, "rare": 22, "very-rare": 7, "legendary": 1}),
+    HoardTier("CR 11-16", 16, (2, 3), {"common": 10, "uncommon": 25, "rare": 35, "very-rare": 22, "legendary": 8}),
+    HoardTier("CR 17+", None, (2, 4), {"common": 5, "uncommon": 15, "rare": 30, "very-rare": 30, "legendary": 20}),
+)
+
+
+def build_hoard_tables(index) -> Tuple[Tuple[np.ndarray, Tuple[Item, ...]], ...]:
+    # Per tier, every eligible item with its cumulative probability (tier rarity weight split evenly over that
+    # rarity's items), so a hoard draw is one searchsorted over a table built once per catalogue.
+    tables = []
+    for tier in HOARD_TIERS:
+        items: List[Item] = []
+        weights: List[float] = []
+        for rarity, weight in tier.weights.items():
+            pool = index.get((rarity, None, False), ())
+            if weight and pool:
+                items += pool
+                weights += [weight / len(pool)] * len(pool)
+        cdf = np.cumsum(weights)
+        tables.append((cdf / cdf[-1] if len(cdf) else cdf, tuple(items)))
+    return tuple(tables)
+
+
+# Hot-reloadable item catalogue. Weapons.db also holds the inventories, so the file changes on every /loot; the
+# catalogue itself is versioned by a counter that triggers on Weapons_DB_Import bump. A changed file costs one
+# read of that counter, and only a changed counter rebuilds the catalogue -- on a background thread, while draws
+# keep using the old one. The swap is a single reference assignment, so a draw sees either the old catalogue or
+# the new one, never a half-built one.
+
+CATALOGUE_VERSION_DDL = (
+    'CREATE TABLE IF NOT EXISTS "CatalogueVersion" (id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER NOT NULL)',
+    'INSERT OR IGNORE INTO "CatalogueVersion" (id, version) VALUES (0, 0)',
+) + tuple(
+    f'CREATE TRIGGER IF NOT EXISTS catalogue_version_{event.lower()} AFTER {event} ON "Weapons_DB_Import" '
+    f'BEGIN UPDATE "CatalogueVersion" SET version = version + 1 WHERE id = 0; END'
+    for event in ("INSERT", "UPDATE", "DELETE")
+)
+
+
+@dataclass(frozen=True)
+class ItemCatalogue:
+    version: int
+    items: Tuple[Item, ...]
+    index: Dict[Tuple[str, Optional[str], bool], Tuple[Item, ...]]
+    hoard_tables: Tuple[Tuple[np.ndarray, Tuple[Item, ...]], ...]    # one per HOARD_TIERS entry
+
+    @classmethod
+    def load(cls, version: int) -> "ItemCatalogue":
+        items = tuple(_load_items_from_db())
+        index = build_item_index(items)
+        return cls(version, items, index, build_hoard_tables(index))
+
+
+def _file_version(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class CatalogueHolder:
+    def __init__(self, engine, path: str = DB_PATH):
+        self.engine = engine
+        self.path = path
+        with engine.begin() as conn:
+            for ddl in CATALOGUE_VERSION_DDL:
+                conn.execute(text(ddl))
+        self._seen_file = _file_version(path)
+        self._catalogue = ItemCatalogue.load(self.read_version())
+        self._lock = threading.Lock()
+        self._loading = False
+
+    def read_version(self) -> int:
+        with self.engine.connect() as conn:
+            return conn.execute(text('SELECT version FROM "CatalogueVersion" WHERE id = 0')).scalar_one()
+
+    def current(self) -> ItemCatalogue:
+        # One stat() per call. Never waits on a rebuild: until the new catalogue is ready this is the old one.
+        file_version = _file_version(self.path)
+        if file_version != self._seen_file:
+            if self.read_version() == self._catalogue.version or self._start_reload():
+                self._seen_file = file_version
+        return self._catalogue
+
+    def _start_reload(self) -> bool:
+        # False if a reload is already running; current() then checks again on the next call.
+        with self._lock:
+            if self._loading:
+                return False
+            self._loading = True
+        threading.Thread(target=self._reload, name="item-catalogue-reload", daemon=True).start()
+        return True
+
+    def _reload(self):
+        try:
+            version = self.read_version()
+            while True:
+                catalogue = ItemCatalogue.load(version)
+                self._catalogue = catalogue
+                # the catalogue changed again while we were loading
+                latest = self.read_version()
+                if latest == version:
+                    break
+                version = latest
+        finally:
+            with self._lock:
+                self._loading = False
+
+    def reload(self) -> ItemCatalogue:
+        # Rebuild right now, in this thread.
+        self._catalogue = ItemCatalogue.load(self.read_version())
+        return self._catalogue
+
+
+catalogue = CatalogueHolder(engine)
 
 
 # Rarity and arg parsing 
@@ -149,73 +324,225 @@ def parse_item_args(arg_string: str):
     item_type = " ".join(type_words) if type_words else "any"
     return rarity, item_type, magic_only
 
+
+class AliasTable:
+    # Walker alias table: a weighted pick in constant time from one uniform draw, however many outcomes there are.
+    # Column i is kept with probability prob[i], otherwise it hands over to alias[i].
+
+    def __init__(self, weights: Dict[str, float]):
+        self.outcomes = list(weights)
+        n = len(self.outcomes)
+        total = sum(weights.values())
+        scaled = [weights[o] * n / total for o in self.outcomes]
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # whatever is left is 1.0 up to float error
+
+    def draw(self, rng):
+        u = rng.random() * len(self.outcomes)
+        column = int(u)
+        if u - column >= self.prob[column]:
+            column = self.alias[column]
+        return self.outcomes[column]
+
+    def draw_many(self, u: np.ndarray) -> np.ndarray:
+        # Outcome positions (into self.outcomes) for a whole array of uniform draws at once.
+        u = u * len(self.outcomes)
+        column = u.astype(np.int64)
+        keep = (u - column) < np.asarray(self.prob)[column]
+        return np.where(keep, column, np.asarray(self.alias)[column])
+
+
+RARITY_ALIAS = AliasTable(RARITY_WEIGHTS)
+
+
 # For random rarity items
-def _choose_rarity() -> str:
-    rarities = list(RARITY_WEIGHTS.keys())
-    weights = list(RARITY_WEIGHTS.values())
-    return random.choices(rarities, weights=weights, k=1)[0]
+def _choose_rarity(rng) -> str:
+    return RARITY_ALIAS.draw(rng)
 
 
 # Random item/loot - AM
 
-def random_item(rarity: Optional[str] = None, type_: Optional[str] = None, magic_only: bool = False) -> Optional[Item]:
+def random_item(rarity: Optional[str] = None, type_: Optional[str] = None, magic_only: bool = False, rng=None) -> Optional[Item]:
   # Pick one random item, filtered by rarity/type/magic-only flags. If rarity is None or 'random' RARITY_WEIGHTS is used to get a random rarity - AM
+  # rng is the guild's stream from rng_streams, so loot can be replayed like dice rolls.
     
-    if not ITEMS:
+    current = catalogue.current()
+    if not current.items:
         return None
+    if rng is None:
+        rng = rng_streams.stream_for()
     # If no rarity given, pick a random one
     if rarity is None or rarity.lower() in ("random", "any", "none"):
-        rarity = _choose_rarity()
+        rarity = _choose_rarity(rng)
 
     rarity = _normalize_rarity(rarity)
-    # Throw items matching query into a pool, filter while progressing through the query - AM
-    pool = [i for i in ITEMS if i.rarity == rarity]
-
-    if type_:
-        type_ = _normalize_type(type_)
-        pool = [i for i in pool if i.type == type_]
-
-    if magic_only:
-        pool = [i for i in pool if i.magic]
+    type_key = _normalize_type(type_) if type_ else None
+    pool: Sequence[Item] = current.index.get((rarity, type_key, bool(magic_only)), ())
 
     if not pool:
         return None
-    return random.choice(pool)
+    return rng.choice(pool)
 
 
-def random_loot(chest_type: str = "chest", magic_only: bool = False) -> List[Item]:
+# (fewest, most) items per chest type
+CHEST_SIZES = {
+    "pouch": (1, 2), "small": (1, 2),
+    "chest": (2, 4), "medium": (2, 4),
+    "hoard": (4, 8), "large": (4, 8), "boss": (4, 8),
+}
+DEFAULT_CHEST_SIZE = (1, 3)
+
+
+def chest_size(chest_type: str) -> Tuple[int, int]:
+    return CHEST_SIZES.get(chest_type.lower(), DEFAULT_CHEST_SIZE)
+
+
+def random_loot(chest_type: str = "chest", magic_only: bool = False, rng=None) -> List[Item]:
     
     # Generate a small list of items. chest_type dictates how many items can be generated - AM
 
     chest_type = chest_type.lower()
+    if rng is None:
+        rng = rng_streams.stream_for()
 
-    if chest_type in ("pouch", "small"):
-        n_items = random.randint(1, 2)
-    elif chest_type in ("chest", "medium"):
-        n_items = random.randint(2, 4)
-    elif chest_type in ("hoard", "large", "boss"):
-        n_items = random.randint(4, 8)
-    else:
-        n_items = random.randint(1, 3)
+    n_items = rng.randint(*chest_size(chest_type))
 
     items: List[Item] = []
     for _ in range(n_items):
-        item = random_item(magic_only=magic_only)
+        item = random_item(magic_only=magic_only, rng=rng)
         if item:
             items.append(item)
     return items
 
-def generate_loot_for_user(discord_id: str, chest_type: str = "chest", magic_only: bool = False) -> str:
+# Loot simulation for tuning RARITY_WEIGHTS and chest sizes. Rolls N drops the same way random_loot does (chest
+# size, then a rarity and an item per slot) but as whole NumPy arrays, and only counts what came out. Nothing is
+# written to the DB, and the guild streams aren't touched.
+
+MAX_SIMULATED_DROPS = 5_000_000
+
+
+@dataclass
+class LootSimulation:
+    drops: int
+    items: int                  # items actually found
+    empty_slots: int            # slots whose rarity had nothing matching (random_item returned None)
+    by_rarity: Dict[str, int]
+    by_type: Dict[str, int]
+    by_magic: Dict[str, int]
+
+    @property
+    def items_per_drop(self) -> float:
+        return self.items / self.drops if self.drops else 0.0
+
+
+def simulate_loot(drops: int, chest_type: str = "chest", magic_only: bool = False,
+                  weights: Optional[Dict[str, float]] = None, seed: Optional[int] = None) -> LootSimulation:
+    if not 0 < drops <= MAX_SIMULATED_DROPS:
+        raise ValueError(f"Simulate between 1 and {MAX_SIMULATED_DROPS} drops.")
+    if weights is not None and not sum(w for w in weights.values() if w > 0):
+        raise ValueError("At least one rarity needs a positive weight.")
+    gen = np.random.default_rng(seed)
+    alias = RARITY_ALIAS if weights is None else AliasTable({_normalize_rarity(r): w for r, w in weights.items() if w > 0})
+    index = catalogue.current().index
+
+    low, high = chest_size(chest_type)
+    slots = int(gen.integers(low, high + 1, size=drops).sum())
+    rarities = alias.draw_many(gen.random(slots))
+    picks = gen.random(slots)
+
+    by_rarity: Dict[str, int] = {}
+    by_type: Counter = Counter()
+    by_magic = {"magic": 0, "mundane": 0}
+    empty = 0
+    for code, rarity in enumerate(alias.outcomes):
+        mask = rarities == code
+        n = int(mask.sum())
+        pool = index.get((rarity, None, bool(magic_only)), ())
+        if not pool:
+            empty += n
+            continue
+        counts = np.bincount((picks[mask] * len(pool)).astype(np.int64), minlength=len(pool))
+        by_rarity[rarity] = n
+        for item, count in zip(pool, counts.tolist()):
+            if count:
+                by_type[item.type] += count
+                by_magic["magic" if item.magic else "mundane"] += count
+    return LootSimulation(drops, slots - empty, empty, by_rarity, dict(by_type.most_common()), by_magic)
+
+
+def describe_simulation(sim: LootSimulation, chest_type: str) -> str:
+    def share(n):
+        return f"{n} ({100 * n / sim.items:.1f}%)" if sim.items else "0"
+
+    lines = [f"**{sim.drops} x {chest_type}:** {sim.items} items, {sim.items_per_drop:.2f} per drop"]
+    if sim.empty_slots:
+        lines.append(f"{sim.empty_slots} slot(s) came up empty")
+    lines.append("**By rarity:** " + ", ".join(f"{r.title()} {share(n)}" for r, n in sim.by_rarity.items()))
+    lines.append("**Magic:** " + share(sim.by_magic["magic"]) + " | **Mundane:** " + share(sim.by_magic["mundane"]))
+    lines.append("**By type:**")
+    lines += [f"{t.title()}: {share(n)}" for t, n in sim.by_type.items()]
+    return "\n".join(lines)
+
+
+def hoard_tier(cr: Optional[float] = None, level: Optional[int] = None) -> int:
+    # Position in HOARD_TIERS for a monster's CR, or the party level if there's no CR.
+    value = cr if cr is not None else level
+    if value is None:
+        raise ValueError("A hoard needs a monster CR or a party level.")
+    for i, tier in enumerate(HOARD_TIERS):
+        if tier.max_level is None or value <= tier.max_level:
+            return i
+    return len(HOARD_TIERS) - 1
+
+
+def generate_party_hoard(discord_ids: Sequence[str], cr: Optional[float] = None, level: Optional[int] = None, rng=None) -> Dict[str, List[Item]]:
+    # Loot for every party member from one hoard, drawn from the tier's precomputed table and saved to all of the
+    # inventories in one transaction.
+    if rng is None:
+        rng = rng_streams.stream_for()
+    tier = hoard_tier(cr, level)
+    cdf, items = catalogue.current().hoard_tables[tier]
+    low, high = HOARD_TIERS[tier].items
+
+    drops: Dict[str, List[Item]] = {}
+    for discord_id in dict.fromkeys(str(d) for d in discord_ids):
+        n = rng.randint(low, high)
+        if not items:
+            drops[discord_id] = []
+            continue
+        picks = np.minimum(np.searchsorted(cdf, rng.uniforms(n), side="right"), len(items) - 1)
+        drops[discord_id] = [items[i] for i in picks]
+    save_drops(drops)
+    return drops
+
+
+def describe_party_hoard(drops: Dict[str, List[Item]], names: Dict[str, str]) -> str:
+    lines = []
+    for discord_id, items in drops.items():
+        found = ", ".join(f"{item.name}{' (magic)' if item.magic else ''} ({item.rarity.title()})" for item in items)
+        lines.append(f"**{names.get(discord_id, discord_id)}:** {found or 'nothing'}")
+    return "\n".join(lines)
+
+
+def generate_loot_for_user(discord_id: str, chest_type: str = "chest", magic_only: bool = False, rng=None) -> str:
     
     # Generate loot, save each item to the user's inventory, and return a Discord-friendly message describing the loot.
     
-    items = random_loot(chest_type=chest_type, magic_only=magic_only)
+    items = random_loot(chest_type=chest_type, magic_only=magic_only, rng=rng)
     if not items:
         return "The chest is empty..."
 
-    # save all items to this user's inventory
-    for item in items:
-        save_item_to_user(discord_id, item)
+    # save the whole drop to this user's inventory in one go
+    save_items_to_user(discord_id, items)
 
     # build the same style of text as build_loot_message()
     lines = []
@@ -232,19 +559,33 @@ def _parse_magic_flag(magic_only: str) -> bool:
 
 # Inventory stuff
 
+def save_drops(drops: Dict[str, Iterable[Item]]) -> None:
+    # Add loot for one or more users ({discord id: items}) in one transaction. Items a user already has are added
+    # to the existing stack's Quantity (an upsert on DiscordID + WeaponID), so a hoard is one commit, not one per item.
+    rows = [
+        {"DiscordID": str(discord_id), "WeaponID": weapon_id, "Quantity": quantity}
+        for discord_id, items in drops.items()
+        for weapon_id, quantity in Counter(item.weapon_id for item in items).items()
+    ]
+    if not rows:
+        return
+    stmt = sqlite_insert(InventoryModel.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["DiscordID", "WeaponID"],
+        set_={"Quantity": InventoryModel.__table__.c.Quantity + stmt.excluded.Quantity},
+    )
+    with engine.begin() as conn:
+        conn.execute(stmt, rows)
+
+
+def save_items_to_user(discord_id: str, items: Iterable[Item]) -> None:
+    # Add a whole drop to one user's inventory in one transaction.
+    save_drops({discord_id: items})
+
+
 def save_item_to_user(discord_id: str, item: Item, quantity: int = 1) -> None:
-    # Create an Inventory row for this user + item. - AM
-    session = SessionLocal()
-    try:
-        inv = InventoryModel(
-            DiscordID=str(discord_id),
-            WeaponID=item.weapon_id,
-            Quantity=quantity,
-        )
-        session.add(inv)
-        session.commit()
-    finally:
-        session.close()
+    # Add quantity of one item to the user's inventory. - AM
+    save_items_to_user(discord_id, [item] * quantity)
 
 
 def get_items_for_user(discord_id: str) -> List[Item]:
@@ -261,28 +602,28 @@ def get_items_for_user(discord_id: str) -> List[Item]:
 
         items: List[Item] = []
         for inv, weapon in rows:
-            items.append(
-                Item(
-                    weapon_id=weapon.WeaponID,
-                    name=weapon.Name,
-                    rarity=_normalize_rarity(weapon.Rarity),
-                    type=_normalize_type(weapon.Type),
-                    magic=bool(weapon.Magic),
-                )
+            item = Item(
+                weapon_id=weapon.WeaponID,
+                name=weapon.Name,
+                rarity=_normalize_rarity(weapon.Rarity),
+                type=_normalize_type(weapon.Type),
+                magic=bool(weapon.Magic),
             )
+            # one row is a stack now, so list it once per copy
+            items.extend([item] * inv.Quantity)
         return items
     finally:
         session.close()
 
 
-def generate_item_for_user(discord_id: str, rarity: str = "random", item_type: str = "any", magic_only: str = "no") -> str:
+def generate_item_for_user(discord_id: str, rarity: str = "random", item_type: str = "any", magic_only: str = "no", rng=None) -> str:
     # Generate an item, save it to the user's inventory, and return text describing the item. - AM
     
     rarity_arg = None if rarity.lower() in ("random", "any", "none") else rarity
     type_arg = None if item_type.lower() in ("any", "none") else item_type
     magic_flag = _parse_magic_flag(magic_only)
 
-    item = random_item(rarity=rarity_arg, type_=type_arg, magic_only=magic_flag)
+    item = random_item(rarity=rarity_arg, type_=type_arg, magic_only=magic_flag, rng=rng)
     if not item:
         return "I couldn't find an item matching those filters."
 
@@ -295,13 +636,13 @@ def generate_item_for_user(discord_id: str, rarity: str = "random", item_type: s
     )
 
 def clear_inventory_for_user(discord_id: str) -> int:
-   # Delete all inventory entries for the given user. Returns the number of rows deleted. - AM
+   # Delete all inventory entries for the given user. Returns the number of items deleted. - AM
     session = SessionLocal()
     try:
         q = session.query(InventoryModel).filter(
             InventoryModel.DiscordID == str(discord_id)
         )
-        count = q.count()
+        count = q.with_entities(func.coalesce(func.sum(InventoryModel.Quantity), 0)).scalar()
         q.delete(synchronize_session=False)
         session.commit()
         return count
@@ -309,19 +650,114 @@ def clear_inventory_for_user(discord_id: str) -> int:
         session.close()
 
 
-def build_inventory_message(discord_id: str) -> str:
-    # Discord message for user inventory - AM
-    items = get_items_for_user(discord_id)
-    if not items:
-        return "You don't have any items yet."
+INVENTORY_PAGE_SIZE = 20
 
-    lines = []
-    for idx, item in enumerate(items, start=1):
-        magic_text = " (magic)" if item.magic else ""
-        lines.append(
-            f"{idx}. {item.name}{magic_text} — {item.rarity.title()} {item.type.title()}"
+
+def get_inventory_page(discord_id: str, after: Optional[Tuple[str, int]] = None, limit: int = INVENTORY_PAGE_SIZE) -> List[InventoryStack]:
+    # One page of the user's inventory, stacked per item and sorted by name. Paging is keyset-based: pass the
+    # (name, weapon id) of the last stack on the previous page as `after`, so page 50 costs the same as page 1.
+    # The DiscordID lookup runs on ux_inventory_user_weapon.
+    inv = InventoryModel.__table__.c
+    weapon = WeaponModel.__table__.c
+    name = func.coalesce(weapon.Name, "")
+    stmt = (
+        select(weapon.WeaponID, weapon.Name, weapon.Rarity, weapon.Type, weapon.Magic, func.sum(inv.Quantity))
+        .join_from(InventoryModel.__table__, WeaponModel.__table__, inv.WeaponID == weapon.WeaponID)
+        .where(inv.DiscordID == str(discord_id))
+        .group_by(weapon.WeaponID)
+        .order_by(name, weapon.WeaponID)
+        .limit(limit)
+    )
+    if after is not None:
+        stmt = stmt.where(tuple_(name, weapon.WeaponID) > tuple_(*after))
+    with engine.connect() as conn:
+        rows = conn.execute(stmt).all()
+    return [
+        InventoryStack(
+            Item(
+                weapon_id=weapon_id,
+                name=weapon_name,
+                rarity=_normalize_rarity(rarity),
+                type=_normalize_type(type_),
+                magic=bool(magic),
+            ),
+            quantity,
         )
+        for weapon_id, weapon_name, rarity, type_, magic, quantity in rows
+    ]
 
-    return "**Your inventory:**\n" + "\n".join(lines)
 
+def inventory_totals(discord_id: str) -> Tuple[int, int]:
+    # (different items, total items) in the user's inventory.
+    inv = InventoryModel.__table__.c
+    stmt = select(func.count(func.distinct(inv.WeaponID)), func.coalesce(func.sum(inv.Quantity), 0)).where(inv.DiscordID == str(discord_id))
+    with engine.connect() as conn:
+        return tuple(conn.execute(stmt).one())
 
+
+def _inventory_lines(stacks: List[InventoryStack], start: int = 1) -> List[str]:
+    lines = []
+    for idx, stack in enumerate(stacks, start=start):
+        item = stack.item
+        magic_text = " (magic)" if item.magic else ""
+        count_text = f" x{stack.quantity}" if stack.quantity > 1 else ""
+        lines.append(f"{idx}. {item.name}{count_text}{magic_text} — {item.rarity.title()} {item.type.title()}")
+    return lines
+
+
+def build_inventory_message(discord_id: str) -> str:
+    # Discord message for user inventory. Only the first page; /inventory pages through the rest with inventory_nav. - AM
+    stacks = get_inventory_page(discord_id)
+    if not stacks:
+        return "You don't have any items yet."
+    return "**Your inventory:**\n" + "\n".join(_inventory_lines(stacks))
+
+
+# Paged /inventory. The view keeps the keyset key each visited page starts after, never the inventory itself.
+class inventory_nav(discord.ui.View):
+    def __init__(self, discord_id: str, title: str):
+        super().__init__()
+        self.discord_id = str(discord_id)
+        self.title = title
+        self.starts: List[Optional[Tuple[str, int]]] = [None]   # keyset key for each page seen so far
+        self.page = 0
+        self.stacks, self.has_more = self._load(None)
+        self.unique, self.total = inventory_totals(self.discord_id)
+        self._update_buttons()
+
+    def _load(self, after):
+        stacks = get_inventory_page(self.discord_id, after, INVENTORY_PAGE_SIZE + 1)
+        return stacks[:INVENTORY_PAGE_SIZE], len(stacks) > INVENTORY_PAGE_SIZE
+
+    def _update_buttons(self):
+        self.prev.disabled = self.page == 0
+        self.next.disabled = not self.has_more
+
+    def embed(self) -> discord.Embed:
+        if not self.stacks:
+            description = "You don't have any items yet."
+        else:
+            description = "\n".join(_inventory_lines(self.stacks, start=self.page * INVENTORY_PAGE_SIZE + 1))
+        embed = discord.Embed(title=self.title, description=description, color=0x3498db)
+        pages = max(1, -(-self.unique // INVENTORY_PAGE_SIZE))
+        embed.set_footer(text=f"Page {self.page + 1}/{pages} — {self.total} item(s), {self.unique} different")
+        return embed
+
+    @discord.ui.button(label="◀️", style=discord.ButtonStyle.primary)
+    async def prev(self, interaction, button):
+        if self.page > 0:
+            self.page -= 1
+            self.stacks, self.has_more = self._load(self.starts[self.page])
+        self._update_buttons()
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+    @discord.ui.button(label="▶️", style=discord.ButtonStyle.primary)
+    async def next(self, interaction, button):
+        if self.has_more:
+            last = self.stacks[-1].item
+            self.page += 1
+            if len(self.starts) <= self.page:
+                self.starts.append((last.name or "", last.weapon_id))
+            self.stacks, self.has_more = self._load(self.starts[self.page])
+        self._update_buttons()
+        await interaction.response.edit_message(embed=self.embed(), view=self)
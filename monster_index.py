@@ -0,0 +1,294 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# In-memory, columnar snapshot of the monster catalogue. The monsters DB is static between ingests, so it is
+# read once into NumPy columns (AC, HP, ability scores) plus interned codes for the text fields, and /monster
+# searches are answered with vectorized masks instead of a query + ORM hydration per call. The snapshot is
+# rebuilt when the DB file changes.
+
+DB_PATH = "data/monsters.db"
+ABILITIES = ("strength", "dexterity", "constitution", "intelligence", "wisdom", "charisma")
+
+
+# Same attribute names as data.monsters.Monster, so anything that reads a Monster (the embed, the session log) reads a record too.
+class MonsterRecord(NamedTuple):
+    index: int
+    name: str
+    url: Optional[str]
+    CR: Optional[str]
+    category: Optional[str]
+    size: Optional[str]
+    AC: Optional[int]
+    HP: Optional[int]
+    speed: Optional[str]
+    alignment: Optional[str]
+    legendary: bool
+    source: Optional[str]
+    strength: Optional[int]
+    dexterity: Optional[int]
+    constitution: Optional[int]
+    intelligence: Optional[int]
+    wisdom: Optional[int]
+    charisma: Optional[int]
+    cr_value: Optional[float]
+
+
+_SELECT = (
+    'SELECT "index", name, url, cr, category, size, ac, hp, speed, align, legendary, source, '
+    'str, dex, con, int, wis, cha, cr_value FROM monsters ORDER BY "index"'
+)
+
+
+def _to_int(value):
+    return None if value is None else int(value)
+
+
+def _record(row) -> MonsterRecord:
+    # legendary is stored as the text '0'/'1', which a plain bool() would read as True either way
+    values = list(row)
+    values[10] = str(values[10]).strip() in ("1", "True", "true")
+    for i in (6, 7, 12, 13, 14, 15, 16, 17):
+        values[i] = _to_int(values[i])
+    return MonsterRecord(*values)
+
+
+def _intern(values) -> Tuple[np.ndarray, Dict[str, int]]:
+    # Text column -> small int codes + vocabulary. Missing values get code -1.
+    vocab: Dict[str, int] = {}
+    codes = np.empty(len(values), dtype=np.int16)
+    for i, value in enumerate(values):
+        codes[i] = -1 if value is None else vocab.setdefault(value, len(vocab))
+    return codes, vocab
+
+
+def _int_column(values, missing=-1) -> np.ndarray:
+    return np.array([missing if v is None else v for v in values], dtype=np.int32)
+
+
+def _display_name(name: str) -> str:
+    return name.replace("-", " ")
+
+
+def _trigrams(text: str):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    # Typo-tolerant name lookup for /monster autocomplete. A prefix trie answers "adult re" (and word starts
+    # like "red dra"), and a trigram index catches typos like "beholdr". Everything lives in memory, so a
+    # keystroke never reaches the DB.
+
+    TRIE_KEEP = 25          # row ids kept per trie node and rank, in name order
+    MIN_SIMILARITY = 0.25   # trigram Jaccard cutoff for fuzzy matches
+
+    def __init__(self, names: List[str]):
+        self.names = [_display_name(n) for n in names]
+        order = sorted(range(len(self.names)), key=lambda i: self.names[i])
+        self._trie: Dict[str, dict] = {}
+        self._gram_count = np.zeros(len(self.names), dtype=np.int32)
+        postings: Dict[str, List[int]] = {}
+        for row in order:
+            name = self.names[row].lower()
+            words = name.split(" ")
+            # every word start is a key, so "dragon" finds "adult red dragon"
+            for w in range(len(words)):
+                self._insert(" ".join(words[w:]), row, rank=0 if w == 0 else 1)
+            grams = _trigrams(name)
+            self._gram_count[row] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(row)
+        self._postings = {gram: np.array(rows, dtype=np.int32) for gram, rows in postings.items()}
+
+    def _insert(self, key: str, row: int, rank: int):
+        node = self._trie
+        for ch in key:
+            node = node.setdefault(ch, {})
+            hits = node.setdefault("", ([], []))[rank]
+            if len(hits) < self.TRIE_KEEP:
+                hits.append(row)
+
+    def _prefix(self, text: str):
+        node = self._trie
+        for ch in text:
+            node = node.get(ch)
+            if node is None:
+                return []
+        whole_name, word_start = node.get("", ([], []))
+        return whole_name + word_start
+
+    def _fuzzy(self, text: str, limit: int):
+        grams = _trigrams(text)
+        hit_lists = [self._postings[g] for g in grams if g in self._postings]
+        if not hit_lists:
+            return []
+        hits = np.bincount(np.concatenate(hit_lists), minlength=len(self.names))
+        score = hits / (len(grams) + self._gram_count - hits)
+        rows = np.flatnonzero(score >= self.MIN_SIMILARITY)
+        rows = rows[np.argsort(-score[rows], kind="stable")][:limit]
+        return rows.tolist()
+
+    def suggest(self, text: str, limit: int = 25) -> List[str]:
+        # Full-name prefix matches first, then word-prefix matches, then fuzzy matches by similarity.
+        text = _display_name(text.strip().lower())
+        if not text:
+            return sorted(self.names)[:limit]
+        rows: List[int] = []
+        for row in self._prefix(text):
+            if row not in rows:
+                rows.append(row)
+        if len(rows) < limit:
+            for row in self._fuzzy(text, limit):
+                if row not in rows:
+                    rows.append(row)
+        return [self.names[row] for row in rows[:limit]]
+
+
+class MonsterSnapshot:
+    def __init__(self, records: List[MonsterRecord], version=None):
+        self.version = version
+        self.records = tuple(records)
+        self.ids = np.array([r.index for r in records], dtype=np.int64)
+        self.ac = _int_column([r.AC for r in records])
+        self.hp = _int_column([r.HP for r in records])
+        self.cr = np.array([np.nan if r.cr_value is None else r.cr_value for r in records], dtype=np.float64)
+        self.abilities = np.array(
+            [[np.nan if getattr(r, a) is None else getattr(r, a) for a in ABILITIES] for r in records],
+            dtype=np.float32,
+        ).reshape(len(records), len(ABILITIES))
+        self.size, self.size_vocab = _intern([r.size for r in records])
+        self.category, self.category_vocab = _intern([r.category for r in records])
+        self.align, self.align_vocab = _intern([r.alignment for r in records])
+        self.speed, self.speed_vocab = _intern([r.speed for r in records])
+        self.legendary = np.array([r.legendary for r in records], dtype=bool)
+        self._row_by_name = {r.name: i for i, r in enumerate(records)}
+        self._row_by_id = {r.index: i for i, r in enumerate(records)}
+        self.name_index = NameIndex([r.name for r in records])
+
+    @classmethod
+    def load(cls, engine, version=None) -> "MonsterSnapshot":
+        with engine.connect() as conn:
+            rows = conn.exec_driver_sql(_SELECT).fetchall()
+        return cls([_record(row) for row in rows], version)
+
+    def __len__(self):
+        return len(self.records)
+
+    def record(self, index: int) -> Optional[MonsterRecord]:
+        row = self._row_by_id.get(index)
+        return None if row is None else self.records[row]
+
+    def _code_mask(self, codes, vocab, value):
+        code = vocab.get(value)
+        if code is None:
+            return np.zeros(len(codes), dtype=bool)
+        return codes == code
+
+    def mask(self, filters) -> np.ndarray:
+        # One boolean mask over every monster for a MonsterFilter. Missing AC/HP/CR never satisfy a range.
+        mask = np.ones(len(self.records), dtype=bool)
+        if filters.name:
+            mask[:] = False
+            row = self._row_by_name.get(filters.name)
+            if row is not None:
+                mask[row] = True
+        if filters.category:
+            mask &= self._code_mask(self.category, self.category_vocab, filters.category)
+        if filters.size:
+            mask &= self._code_mask(self.size, self.size_vocab, filters.size)
+        if filters.speed:
+            mask &= self._code_mask(self.speed, self.speed_vocab, filters.speed)
+        if filters.align:
+            mask &= self._code_mask(self.align, self.align_vocab, filters.align)
+        if filters.legendary is not None:
+            mask &= self.legendary == filters.legendary
+        if filters.minac is not None:
+            mask &= (self.ac >= filters.minac) & (self.ac >= 0)
+        if filters.maxac is not None:
+            mask &= (self.ac <= filters.maxac) & (self.ac >= 0)
+        if filters.minhp is not None:
+            mask &= (self.hp >= filters.minhp) & (self.hp >= 0)
+        if filters.maxhp is not None:
+            mask &= (self.hp <= filters.maxhp) & (self.hp >= 0)
+        # NaN (unknown CR) fails both comparisons
+        if filters.mincr is not None:
+            mask &= self.cr >= filters.mincr
+        if filters.maxcr is not None:
+            mask &= self.cr <= filters.maxcr
+        return mask
+
+    def search(self, filters) -> List[MonsterRecord]:
+        return [self.records[row] for row in np.flatnonzero(self.mask(filters))]
+
+
+class QueryCache:
+    # Small TTL + LRU map for search results. Entries expire after `ttl` seconds and the least recently used
+    # entry is evicted past `maxsize`. hits/misses are kept for monitoring.
+
+    def __init__(self, maxsize: int = 256, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[object, Tuple[float, object]]" = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def info(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "maxsize": self.maxsize}
+
+
+def _db_version(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class SnapshotHolder:
+    # Keeps the current snapshot and swaps in a new one when the DB file's mtime/size changes. Listeners
+    # (caches built on top of the snapshot) are told after every swap.
+
+    def __init__(self, engine, path: str = DB_PATH):
+        self.engine = engine
+        self.path = path
+        self._snapshot: Optional[MonsterSnapshot] = None
+        self._listeners: List[Callable[[MonsterSnapshot], None]] = []
+
+    def add_refresh_listener(self, listener: Callable[[MonsterSnapshot], None]) -> None:
+        self._listeners.append(listener)
+
+    def refresh(self, force: bool = False) -> MonsterSnapshot:
+        version = _db_version(self.path)
+        if force or self._snapshot is None or version != self._snapshot.version:
+            self._snapshot = MonsterSnapshot.load(self.engine, version)
+            for listener in self._listeners:
+                listener(self._snapshot)
+        return self._snapshot
+
+    def current(self) -> MonsterSnapshot:
+        # One stat() per call; the rebuild only happens when the file actually changed.
+        return self.refresh()
@@ -1,21 +1,48 @@
-from data.monsters import Base, Monster
+from data.monsters import Base, Monster, parse_cr, ensure_cr_value, ensure_monster_fts
+from monster_index import SnapshotHolder, MonsterRecord, QueryCache
 import sqlalchemy as sqla
-from sqlalchemy.orm import sessionmaker
+import json
 import random
-from typing import Literal
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Literal, Optional
 import discord
+import numpy as np
+import rng_streams
 
 
 # Connects to the monstermanual DB, allows us to access it. --SM
 DATABASE_URL = "sqlite:///data/monsters.db"
 engine = sqla.create_engine(DATABASE_URL)
 Base.metadata.create_all(bind=engine)
-session_factory = sessionmaker(bind=engine)
-Session = session_factory
-session = Session()
+
+# The shipped DB predates cr_value, the search indexes and the full-text index, so bring it up to date on startup.
+_raw_conn = engine.raw_connection()
+try:
+    ensure_cr_value(_raw_conn.dbapi_connection)
+finally:
+    _raw_conn.close()
+# create_all skips tables that already exist, so add any search indexes the shipped DB is missing.
+for index in Monster.__table__.indexes:
+    index.create(bind=engine, checkfirst=True)
+
+_raw_conn = engine.raw_connection()
+try:
+    ensure_monster_fts(_raw_conn.dbapi_connection)
+finally:
+    _raw_conn.close()
+
+# Columnar snapshot of the catalogue that /monster searches run against. Loaded once here and rebuilt when data/monsters.db changes.
+snapshots = SnapshotHolder(engine)
+snapshots.refresh()
+
+# Matching monster indexes per normalized search (a MonsterFilter), so a repeated /monster search is a dict lookup. Emptied whenever the snapshot is reloaded.
+query_cache = QueryCache(maxsize=256, ttl=600.0)
+snapshots.add_refresh_listener(lambda snapshot: query_cache.clear())
 
 # Dedicated method to build the embed for the monster. I made it it's own method for easier maintenance, as well as attempting to make things look cleaner by removing such a large block of code from another method --SM
-def mm_build_embed(monster: Monster):
+def mm_build_embed(monster: MonsterRecord):
     embed = discord.Embed(
             title="Monster Manual",
             description=monster.name,
@@ -40,6 +67,23 @@ def mm_build_embed(monster: Monster):
     embed.add_field(name="View Page:", value=monster.url, inline=False)
     
     return embed
+# Prebuilt embed payloads keyed by monster index. Paging through popular monsters is mostly cache hits, so a button press doesn't rebuild 17 fields every time. Cleared whenever the catalogue snapshot is reloaded; embed_cache_info() gives the hit/miss counters.
+EMBED_CACHE_SIZE = 512
+
+@lru_cache(maxsize=EMBED_CACHE_SIZE)
+def _embed_payload(index: int) -> dict:
+    return mm_build_embed(snapshots.current().record(index)).to_dict()
+
+snapshots.add_refresh_listener(lambda snapshot: _embed_payload.cache_clear())
+
+# Embed for a monster from the cache. The field list is copied so the cached payload can't be changed through the returned embed.
+def monster_embed(monster: MonsterRecord):
+    payload = _embed_payload(monster.index)
+    return discord.Embed.from_dict({**payload, "fields": [dict(field) for field in payload["fields"]]})
+
+def embed_cache_info():
+    return _embed_payload.cache_info()
+
 ## I was having an issue of multiple monsters printing individual messages. This allows the end user to navigate through a menu of monsters meeting their described search instead of having to use individual embeds, meet the needs of character requirements, etc.--SM
 
 """Credit goes to these resources for helping me to understand better:
@@ -48,45 +92,40 @@ All you need to know about Buttons in Discord.py & Pycord (By code with Swastik)
 PyCord Guide - Buttons: https://guide.pycord.dev/interactions/ui-components/buttons
 """
 class menu_nav(discord.ui.View):
-    def __init__(self, monsters:list[Monster], ctx, tracker):
+    # The view only holds a cursor (the search filter + the monster currently shown), never the result list, so an open menu costs the same for one match or the whole catalogue.
+    def __init__(self, cursor, ctx, tracker):
         super().__init__()
-        self.current_page = 0
-        self.num_pages = len(monsters)
-        self.monsters = monsters
+        self.cursor = cursor
         self.ctx = ctx
         self.tracker = tracker
 
     @discord.ui.button(label="◀️", style=discord.ButtonStyle.primary)
     async def prev(self, interaction, button):
-        if self.current_page == 0:
+        if self.cursor.prev() is None:
             button.disabled = True
-        else:
-            self.current_page -= 1
-        await interaction.response.edit_message(embed=mm_build_embed(self.monsters[self.current_page]))
+        await interaction.response.edit_message(embed=monster_embed(self.cursor.current()))
 
     @discord.ui.button(label="Log for Session", style=discord.ButtonStyle.success)
     async def track_monster(self, interaction, button):
         active_session = self.tracker.get_active_session(self.ctx.guild.id)
         await interaction.response.defer()
-        monster_to_track = [self.monsters[self.current_page]]
+        monster = self.cursor.current()
         if active_session:
-            self.tracker.record_monster(self.ctx.guild.id, self.ctx.user.name, monster_to_track)
-            await interaction.followup.send(f"Successfully tracked {self.monsters[self.current_page].name} to session log.", ephemeral=True)
+            self.tracker.record_monster(self.ctx.guild.id, self.ctx.user.name, [monster])
+            await interaction.followup.send(f"Successfully tracked {monster.name} to session log.", ephemeral=True)
         else:
             await interaction.followup.send(f"Unable to track monster: No session is currently active.", ephemeral=True)
 
     @discord.ui.button(label="▶️", style=discord.ButtonStyle.primary)
     async def next(self, interaction, button):
-        if self.current_page == len(self.monsters) - 1:
+        if self.cursor.next() is None:
             button.disabled = True
-        else:
-            self.current_page += 1
-        await interaction.response.edit_message(embed=mm_build_embed(self.monsters[self.current_page]))
+        await interaction.response.edit_message(embed=monster_embed(self.cursor.current()))
         
     
 ## Acceptable values for search input that depends on a strict set of values.--SM
 class mm_literals:
-    valid_params = ["name", "category", "size", "minac", "maxac", "minhp", "maxhp", "speed", "align", "legendary"]
+    valid_params = ["name", "category", "size", "minac", "maxac", "minhp", "maxhp", "speed", "align", "legendary", "mincr", "maxcr"]
 
     sizes = Literal['Tiny', 'Small', 'Medium', 'Large', 'Gargantuan']
 
@@ -94,66 +133,153 @@ class mm_literals:
 
     alignments = Literal["neutral good","any alignment","lawful evil","chaotic evil","neutral evil","chaotic good","lawful good","unaligned","neutral","lawful neutral"]
 
-# Removes null and empty values from the user response. i.e /monster category:undead provides only the search term undead.--SM
-async def clean_dict(dict_vals):
-    dict_vals = {k: v for k, v in dict_vals.items() if v}
-    return dict_vals
-
-# Resource used: https://www.w3schools.com/python/python_lists_comprehension.asp
-def filter_by_ac(minac, maxac, monsters):
-    if maxac is None:
-        filtered_monsters = [monster for monster in monsters if monster.AC >= minac]
-    elif minac is None:
-        filtered_monsters = [monster for monster in monsters if monster.AC <= maxac]
-    else:
-        filtered_monsters = [monster for monster in monsters if monster.AC >= minac and monster.AC <= maxac]
-    return filtered_monsters
-
-def filter_by_hp(minhp, maxhp, monsters):
-    if maxhp is None:
-        filtered_monsters = [monster for monster in monsters if monster.HP >= minhp]
-    elif minhp is None:
-        filtered_monsters = [monster for monster in monsters if monster.HP <= maxhp]
-    else:
-        filtered_monsters = [monster for monster in monsters if monster.HP >= minhp and monster.HP <= maxhp]
-    return filtered_monsters
-
-# Search for a monster by varying search terms. If name is null, presents a random monster from the database. --SM
-async def find_monster(name=None, category=None, size=None, minac=None, maxac=None, minhp=None, maxhp=None, speed=None, align=None, legendary=None):
-    results = []
-    if name:
-        name = name.replace(" ","-")
-    if legendary == "Yes":
-        legendary = 1
-    elif legendary == "No":
-        legendary == 0
-    search_vals = {
-        "name": name,
-        "category" : category,
-        "size" : size,
-        "speed" : speed,
-        "alignment":  align,
-        "legendary" : legendary
-        }
-    search_vals = await clean_dict(search_vals)
-    if not search_vals:
-        results = session.query(Monster).all()
-    else:
-        # TODO: Pull Random values matching the more vague search terms.--SM
-        results = session.query(Monster).filter_by(**search_vals).all()
-    if minac or maxac:
-        results = filter_by_ac(minac, maxac, results)
-    if minhp or maxhp:
-        results = filter_by_hp(minhp, maxhp, results)
-    return results
-
-
-# Creates the menu for the monster display with the embed, buttons. Creates the first monster from the results of the search allowing for a starting point of the menu. Tracker is passed from bot.py to allow us to use the session_tracker's record_monster function.--SM
-async def display_monsters(ctx, monsters: list[Monster], tracker, reveal):
-    view = menu_nav(monsters, ctx,tracker)
-    first_monster = mm_build_embed(monsters[0])
+# Normalized /monster search terms. None means "don't filter on this". Frozen so a search can be stored or used as a dict key.
+@dataclass(frozen=True)
+class MonsterFilter:
+    name: Optional[str] = None
+    category: Optional[str] = None
+    size: Optional[str] = None
+    minac: Optional[int] = None
+    maxac: Optional[int] = None
+    minhp: Optional[int] = None
+    maxhp: Optional[int] = None
+    speed: Optional[str] = None
+    align: Optional[str] = None
+    legendary: Optional[bool] = None
+    mincr: Optional[float] = None
+    maxcr: Optional[float] = None
+
+    # Builds a filter from the raw /monster options, i.e. /monster category:undead provides only the search term undead. CR bounds may be text like "1/4"; a bad CR raises ValueError.
+    @classmethod
+    def from_search(cls, name=None, category=None, size=None, minac=None, maxac=None, minhp=None, maxhp=None, speed=None, align=None, legendary=None, mincr=None, maxcr=None):
+        if name:
+            name = name.replace(" ","-")
+        if legendary == "Yes":
+            legendary = True
+        elif legendary == "No":
+            legendary = False
+        return cls(name or None, category or None, size or None, minac, maxac, minhp, maxhp, speed or None, align or None, legendary, parse_cr(mincr), parse_cr(maxcr))
+
+# Indexes of every monster matching a filter, in ascending index order. Served from query_cache when the same search was run recently.
+def matching_ids(filters: MonsterFilter):
+    snapshot = snapshots.current()
+    ids = query_cache.get(filters)
+    if ids is None:
+        ids = snapshot.ids[snapshot.mask(filters)]
+        ids.flags.writeable = False
+        query_cache.put(filters, ids)
+    return ids
+
+# Keyset cursor over a search: keeps only the filter and the index of the monster on screen. prev/next look up the neighbouring match when pressed, so nothing about the result set is stored between presses.
+class MonsterCursor:
+    def __init__(self, filters: MonsterFilter):
+        self.filters = filters
+        self.position = None
+
+    @classmethod
+    def from_search(cls, **search):
+        return cls(MonsterFilter.from_search(**search))
+
+    def current(self):
+        return snapshots.current().record(self.position)
+
+    def _move_to(self, ids, i):
+        if i < 0 or i >= len(ids):
+            return None
+        self.position = int(ids[i])
+        return self.current()
+
+    def first(self):
+        return self._move_to(matching_ids(self.filters), 0)
+
+    def next(self):
+        ids = matching_ids(self.filters)
+        return self._move_to(ids, int(np.searchsorted(ids, self.position, side="right")))
+
+    def prev(self):
+        ids = matching_ids(self.filters)
+        return self._move_to(ids, int(np.searchsorted(ids, self.position, side="left")) - 1)
+
+
+# Pages through a fixed, short list of monster indexes (random picks, encounters) with the same interface as MonsterCursor.
+class ListCursor:
+    def __init__(self, ids):
+        self.ids = tuple(int(i) for i in ids)
+        self.page = 0
+
+    def current(self):
+        return snapshots.current().record(self.ids[self.page])
+
+    def _move_to(self, page):
+        if page < 0 or page >= len(self.ids):
+            return None
+        self.page = page
+        return self.current()
+
+    def first(self):
+        return self._move_to(0)
+
+    def next(self):
+        return self._move_to(self.page + 1)
+
+    def prev(self):
+        return self._move_to(self.page - 1)
+
+
+MAX_RANDOM_MONSTERS = 25
+
+# Picks n random monsters matching a search without building the result list: the sample is drawn straight from the filter's cached id bucket, and only the n picks become records. With target_cr, monsters closer to that CR are more likely (weighted sampling without replacement, Efraimidis-Spirakis keys). rng is the guild's rng_streams stream.
+def sample_monsters(filters: MonsterFilter, n: int, rng=None, target_cr=None):
+    ids = matching_ids(filters)
+    n = max(0, min(n, MAX_RANDOM_MONSTERS, len(ids)))
+    if n == 0:
+        return []
+    if rng is None:
+        rng = rng_streams.stream_for()
+    keys = np.log(rng.uniforms(len(ids)))
+    if target_cr is not None:
+        snapshot = snapshots.current()
+        cr = snapshot.cr[np.searchsorted(snapshot.ids, ids)]
+        weights = 1.0 / (1.0 + np.abs(cr - target_cr)) ** 2
+        keys = keys / np.nan_to_num(weights, nan=1e-6)
+    picks = np.argpartition(-keys, n - 1)[:n]
+    return [int(i) for i in ids[picks[np.argsort(-keys[picks])]]]
+
+
+MAX_TEXT_RESULTS = 25
+
+# Free-text search (/monster query:"young red") over name, category, source and alignment through the FTS5 index. Every word is a prefix match and any word may match; BM25 puts the monsters matching the most (and rarest) words first, with name hits weighted highest. Other search terms are applied to the ranked hits, and the result is a list of monster indexes in rank order.
+def search_monster_text(text: str, filters: Optional[MonsterFilter] = None, limit: int = MAX_TEXT_RESULTS):
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return []
+    match = " OR ".join(f'"{word}"*' for word in words)
+    sql = "SELECT rowid FROM monsters_fts WHERE monsters_fts MATCH ?"
+    params = [match]
+    if filters is not None and filters != MonsterFilter():
+        # the filter goes into the query as a rowid set, so the LIMIT counts only monsters that pass it
+        allowed = matching_ids(filters)
+        if len(allowed) == 0:
+            return []
+        sql += " AND rowid IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(allowed.tolist()))
+    sql += " ORDER BY bm25(monsters_fts, 10.0, 4.0, 1.0, 2.0) LIMIT ?"
+    params.append(limit)
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(sql, tuple(params)).fetchall()
+    return [row[0] for row in rows]
+
+
+# Ranked name suggestions for the /monster name autocomplete, served from the snapshot's name index (no DB query per keystroke).
+def suggest_monster_names(text: str, limit: int = 25) -> list[str]:
+    return snapshots.current().name_index.suggest(text, limit)
+
+
+# Creates the menu for the monster display with the embed, buttons. The cursor must already be on the first monster of the search (cursor.first()), giving the menu its starting point. Tracker is passed from bot.py to allow us to use the session_tracker's record_monster function.--SM
+async def display_monsters(ctx, cursor, tracker, reveal):
+    view = menu_nav(cursor, ctx,tracker)
+    first_monster = monster_embed(cursor.current())
     if reveal == "Yes":
         await ctx.response.send_message(embed=first_monster, view=view)
     else:
         await ctx.response.send_message(embed=first_monster, view=view, ephemeral=True)
-
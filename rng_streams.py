@@ -0,0 +1,110 @@
+import os
+import secrets
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+## Per-guild random number streams for dice and loot. Every guild gets its own seeded NumPy Generator and
+## draws are handed out from a buffer that is refilled in bulk, so a roll never pays for a generator call
+## per die. Because each guild's seed is known and every draw is counted, any roll can be replayed from
+## (seed, position) -- that pair is what goes into the session log.
+
+BUFFER_SIZE = 4096
+
+
+class RNGStream:
+    def __init__(self, seed: int, buffer_size: int = BUFFER_SIZE):
+        self.seed = seed
+        self.buffer_size = buffer_size
+        self.position = 0   # number of draws handed out since seeding
+        self._gen = np.random.Generator(np.random.PCG64(seed))
+        self._buffer = np.empty(0)
+        self._next = 0
+
+    @classmethod
+    def at(cls, seed: int, position: int) -> "RNGStream":
+        # A stream that picks up exactly where `position` draws of `seed` left off. PCG64 can jump ahead
+        # in constant time, so replaying a roll from late in a session is as cheap as the first one.
+        stream = cls(seed)
+        stream._gen.bit_generator.advance(position)
+        stream.position = position
+        return stream
+
+    def uniforms(self, n: int) -> np.ndarray:
+        # n floats in [0, 1). Draws come out in generator order regardless of where the refills happen,
+        # which is what keeps `position` meaningful. Not called `uniform`: on a numpy Generator that takes
+        # `low` first, so uniform(n) would quietly mean something else.
+        if self._next + n > len(self._buffer):
+            rest = self._buffer[self._next:]
+            fresh = self._gen.random(max(self.buffer_size, n - len(rest)))
+            self._buffer = np.concatenate([rest, fresh])
+            self._next = 0
+        out = self._buffer[self._next:self._next + n]
+        self._next += n
+        self.position += n
+        return out
+
+    def random(self) -> float:
+        return float(self.uniforms(1)[0])
+
+    def integers(self, low, high, size=None):
+        # Same contract as numpy.random.Generator.integers (high is exclusive, low/high broadcast), so the
+        # dice roller can take either one.
+        low = np.asarray(low)
+        high = np.asarray(high)
+        shape = np.broadcast_shapes(low.shape, high.shape) if size is None else size
+        shape = (shape,) if isinstance(shape, int) else tuple(shape)
+        u = self.uniforms(int(np.prod(shape, dtype=np.int64))).reshape(shape)
+        out = (low + np.floor(u * (high - low))).astype(np.int64)
+        return out if shape else int(out)
+
+    def randint(self, a: int, b: int) -> int:
+        # Inclusive on both ends, like random.randint.
+        return self.integers(a, b + 1)
+
+    def choice(self, seq: Sequence):
+        return seq[self.integers(0, len(seq))]
+
+
+class RNGService:
+    # Hands out one RNGStream per guild. Guild seeds are derived from a master seed (DND_RNG_SEED in the
+    # environment, or a fresh random one per run) unless a DM sets one explicitly with reseed().
+
+    def __init__(self, master_seed: Optional[int] = None):
+        if master_seed is None:
+            env_seed = os.environ.get("DND_RNG_SEED")
+            master_seed = int(env_seed) if env_seed else secrets.randbits(64)
+        self.master_seed = master_seed
+        self._streams: Dict[str, RNGStream] = {}
+
+    def _derive_seed(self, guild_id) -> int:
+        key = int(guild_id) if guild_id is not None else 0
+        seq = np.random.SeedSequence(entropy=self.master_seed, spawn_key=(key,))
+        return int(seq.generate_state(1, dtype=np.uint64)[0])
+
+    def stream(self, guild_id=None) -> RNGStream:
+        key = str(guild_id)
+        stream = self._streams.get(key)
+        if stream is None:
+            stream = RNGStream(self._derive_seed(guild_id))
+            self._streams[key] = stream
+        return stream
+
+    def reseed(self, guild_id, seed: Optional[int] = None) -> RNGStream:
+        # Start a guild on a new (or given) seed, e.g. at the start of a session.
+        if seed is None:
+            seed = secrets.randbits(64)
+        stream = RNGStream(seed)
+        self._streams[str(guild_id)] = stream
+        return stream
+
+
+service = RNGService()
+
+
+def stream_for(guild_id=None) -> RNGStream:
+    return service.stream(guild_id)
+
+
+def replay(seed: int, position: int) -> RNGStream:
+    return RNGStream.at(seed, position)